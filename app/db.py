@@ -1,16 +1,59 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
 from app.config import settings
 
-engine = create_engine(settings.DATABASE_URL)
+def to_async_url(url: str) -> str:
+    # Same database, reached through an asyncio driver
+    if url.startswith("postgresql://"):
+        return url.replace("postgresql://", "postgresql+asyncpg://", 1)
+    if url.startswith("sqlite://"):
+        return url.replace("sqlite://", "sqlite+aiosqlite://", 1)
+    return url
+
+def engine_options(url: str) -> dict:
+    """Pool settings from Settings, so workers x pool size stays within the database's connection limit."""
+    options = {"pool_pre_ping": settings.DB_POOL_PRE_PING, "pool_recycle": settings.DB_POOL_RECYCLE}
+    # SQLite has no server connections to budget, and in-memory databases use a single-connection pool
+    if not url.startswith("sqlite"):
+        options.update(
+            pool_size=settings.DB_POOL_SIZE,
+            max_overflow=settings.DB_MAX_OVERFLOW,
+            pool_timeout=settings.DB_POOL_TIMEOUT,
+        )
+    return options
+
+def enforce_sqlite_foreign_keys(engine):
+    # Deletes rely on ON DELETE CASCADE, which SQLite ignores unless each connection turns it on
+    if engine.dialect.name != "sqlite":
+        return
+
+    @event.listens_for(engine, "connect")
+    def enable_foreign_keys(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
+
+engine = create_engine(settings.DATABASE_URL, **engine_options(settings.DATABASE_URL))
+enforce_sqlite_foreign_keys(engine)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+async_database_url = settings.ASYNC_DATABASE_URL or to_async_url(settings.DATABASE_URL)
+async_engine = create_async_engine(async_database_url, **engine_options(async_database_url))
+enforce_sqlite_foreign_keys(async_engine.sync_engine)
+# Objects stay readable after commit, since lazy refreshes are not possible under asyncio
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
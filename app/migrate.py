@@ -0,0 +1,122 @@
+"""Bring an existing database up to the current schema.
+
+Run with `python -m app.migrate`. Every step is idempotent, so it is safe to
+run on each deploy, including while other servers are still running.
+"""
+import datetime
+
+from sqlalchemy import inspect, text, func
+
+from app.db import engine, Base, SessionLocal
+from app.models.user_model import User
+from app.models.pdf_model import PDF
+from app.models.knowledge_base_model import KnowledgeBase
+from app.models.chat_history_model import ChatHistory
+from app.models.chat_message_model import ChatMessage
+from app.services.ingestion_service import recover_interrupted_jobs
+
+# Columns added to tables that create_all will not alter once they exist.
+# Append new ones here: (table, column, column definition)
+ADDED_COLUMNS = [
+    ("pdfs", "index_key", "VARCHAR"),
+    ("pdfs", "status", "VARCHAR NOT NULL DEFAULT 'ready'"),
+    ("pdfs", "error", "VARCHAR"),
+    ("pdfs", "fingerprint", "VARCHAR"),
+    ("pdfs", "job_owner", "VARCHAR"),
+    ("pdfs", "job_heartbeat", "TIMESTAMP"),
+    ("pdfs", "spool_path", "VARCHAR"),
+    ("chat_histories", "user_id", "VARCHAR REFERENCES users(id) ON DELETE CASCADE"),
+    ("chat_histories", "summary", "TEXT"),
+    ("chat_histories", "summarized_messages", "INTEGER NOT NULL DEFAULT 0"),
+]
+
+# Columns that used to be NOT NULL
+RELAXED_COLUMNS = [
+    ("pdfs", "content"),
+    ("chat_histories", "pdf_id"),
+]
+
+BATCH_SIZE = 500
+
+
+def upgrade_schema():
+    Base.metadata.create_all(bind=engine)
+
+    inspector = inspect(engine)
+    with engine.begin() as connection:
+        for table, column, definition in ADDED_COLUMNS:
+            existing = {c["name"] for c in inspector.get_columns(table)}
+            if column not in existing:
+                connection.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {definition}"))
+                print(f"Added column {table}.{column}")
+
+        # SQLite cannot drop NOT NULL in place; it is only used for local runs
+        if engine.dialect.name == "postgresql":
+            for table, column in RELAXED_COLUMNS:
+                connection.execute(text(f"ALTER TABLE {table} ALTER COLUMN {column} DROP NOT NULL"))
+
+    # create_all only builds indexes together with new tables
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+
+
+def backfill_knowledge_bases(db):
+    # Indexes stored before reference counting existed
+    rows = db.query(PDF.index_key, func.count(PDF.id)).filter(
+        PDF.index_key.isnot(None)
+    ).group_by(PDF.index_key).all()
+    known = {key for (key,) in db.query(KnowledgeBase.index_key)}
+    for index_key, ref_count in rows:
+        if index_key not in known:
+            db.add(KnowledgeBase(index_key=index_key, ref_count=ref_count))
+    db.commit()
+
+
+def migrate_json_conversations(db):
+    # Move JSON conversation arrays into chat_messages, walking histories by id
+    # one batch per transaction; migrated arrays are emptied so reruns skip them
+    migrated = 0
+    last_id = ""
+    while True:
+        histories = db.query(ChatHistory).filter(
+            ChatHistory.id > last_id
+        ).order_by(ChatHistory.id).limit(BATCH_SIZE).all()
+        if not histories:
+            break
+
+        for history in histories:
+            for turn in history.conversation or []:
+                try:
+                    created_at = datetime.datetime.fromisoformat(turn["timestamp"])
+                except (KeyError, TypeError, ValueError):
+                    created_at = history.created_at
+                db.add(ChatMessage(
+                    conversation_id=history.id,
+                    question=turn.get("user", ""),
+                    answer=turn.get("ai", ""),
+                    created_at=created_at
+                ))
+                migrated += 1
+            if history.conversation:
+                history.conversation = []
+        last_id = histories[-1].id
+        db.commit()
+
+    print(f"Migrated {migrated} messages from JSON conversations")
+
+
+def main():
+    upgrade_schema()
+    db = SessionLocal()
+    try:
+        backfill_knowledge_bases(db)
+        migrate_json_conversations(db)
+        settled = recover_interrupted_jobs(db)
+        print(f"Settled {settled['ingest']} interrupted uploads and {settled['revision']} interrupted revisions")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,6 @@
 import uuid
 import datetime
-from sqlalchemy import Column, String, DateTime, JSON, ForeignKey
+from sqlalchemy import Column, String, Text, Integer, DateTime, JSON, ForeignKey
 from sqlalchemy.orm import relationship
 
 from app.db import Base
@@ -9,9 +9,18 @@ class ChatHistory(Base):
     __tablename__ = "chat_histories"
     
     id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
-    pdf_id = Column(String, ForeignKey("pdfs.id", ondelete="CASCADE"), nullable=False)
-    conversation = Column(JSON, nullable=False, default=list)  # Store chat history as JSON array
+    # Set for a single document's conversation; library conversations span documents and only carry user_id
+    pdf_id = Column(String, ForeignKey("pdfs.id", ondelete="CASCADE"), nullable=True, index=True)
+    user_id = Column(String, ForeignKey("users.id", ondelete="CASCADE"), nullable=True, index=True)
+    # Legacy JSON array of turns; messages now live in chat_messages and `python -m app.migrate` moves old rows over
+    conversation = Column(JSON, nullable=True, default=list)
+    # Rolling summary of the turns that have slid out of the conversational window, and how many it covers
+    summary = Column(Text, nullable=True)
+    summarized_messages = Column(Integer, nullable=False, default=0)
     created_at = Column(DateTime, nullable=False, default=datetime.datetime.utcnow)
     
     # Foreign key to the PDF associated with this chat history
-    pdf = relationship("PDF", back_populates="chat_histories")
\ No newline at end of file
+    pdf = relationship("PDF", back_populates="chat_histories")
+    
+    # One to many relationship with ChatMessage, removed by the database's ON DELETE CASCADE
+    messages = relationship("ChatMessage", back_populates="conversation", cascade="all, delete-orphan", passive_deletes=True)
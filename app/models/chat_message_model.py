@@ -0,0 +1,23 @@
+import uuid
+import datetime
+from sqlalchemy import Column, String, Text, DateTime, ForeignKey, Index
+from sqlalchemy.orm import relationship
+
+from app.db import Base
+
+class ChatMessage(Base):
+    __tablename__ = "chat_messages"
+    
+    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    conversation_id = Column(String, ForeignKey("chat_histories.id", ondelete="CASCADE"), nullable=False)
+    question = Column(Text, nullable=False)
+    answer = Column(Text, nullable=False)
+    created_at = Column(DateTime, nullable=False, default=datetime.datetime.utcnow)
+    
+    # Many to one relationship with ChatHistory
+    conversation = relationship("ChatHistory", back_populates="messages")
+    
+    # Serves appends and history pages, which walk one conversation in (created_at, id) order
+    __table_args__ = (
+        Index("ix_chat_messages_conversation_id_created_at", "conversation_id", "created_at", "id"),
+    )
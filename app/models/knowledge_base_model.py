@@ -0,0 +1,12 @@
+import datetime
+from sqlalchemy import Column, String, Integer, DateTime
+
+from app.db import Base
+
+class KnowledgeBase(Base):
+    __tablename__ = "knowledge_bases"
+    
+    # Content address of the stored index, shared by every PDF row with the same index_key
+    index_key = Column(String, primary_key=True)
+    ref_count = Column(Integer, nullable=False, default=0)  # Number of PDF rows using this index
+    created_at = Column(DateTime, nullable=False, default=datetime.datetime.utcnow)
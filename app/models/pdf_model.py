@@ -1,10 +1,21 @@
 import uuid
 import datetime
-from sqlalchemy import Column, String, Integer, DateTime, LargeBinary, ForeignKey
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, String, Integer, DateTime, LargeBinary, ForeignKey, Index
+from sqlalchemy.orm import relationship, deferred
 
 from app.db import Base
 
+class PDFStatus:
+    QUEUED = "queued"
+    PARSING = "parsing"
+    EMBEDDING = "embedding"
+    READY = "ready"
+    UPDATING = "updating"  # A revision is being applied; the previous revision stays searchable
+    FAILED = "failed"
+    
+    SEARCHABLE = (READY, UPDATING)
+    IN_PROGRESS = (QUEUED, PARSING, EMBEDDING, UPDATING)
+
 class PDF(Base):
     __tablename__ = "pdfs"
     
@@ -12,11 +23,25 @@ class PDF(Base):
     name = Column(String, nullable=False)
     size = Column(Integer, nullable=False) 
     uploaded_date = Column(DateTime, nullable=False, default=datetime.datetime.utcnow)
-    content = Column(LargeBinary, nullable=False)  
+    # Legacy pickled knowledge base, superseded by index_key. Deferred so metadata queries never pull it
+    content = deferred(Column(LargeBinary, nullable=True))
+    index_key = Column(String, nullable=True)  # Content address of the knowledge base in the vector store
+    fingerprint = Column(String, nullable=True, index=True)  # SHA-256 of the uploaded bytes, for deduplication
+    status = Column(String, nullable=False, default=PDFStatus.QUEUED)  # Background ingestion progress
+    error = Column(String, nullable=True)  # Why ingestion failed, when status is failed
+    job_owner = Column(String, nullable=True)  # host:pid of the process running the PDF's ingestion or revision job
+    job_heartbeat = Column(DateTime, nullable=True)  # Last time that process marked the job alive
+    spool_path = Column(String, nullable=True)  # The job's spooled upload
     
     # Foreign key to the user who uploaded the PDF
     user_id = Column(String, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
     
-    # One to many relationship with ChatHistory
-    chat_histories = relationship("ChatHistory", back_populates="pdf", cascade="all, delete-orphan")
-    user = relationship("User", back_populates="pdfs")
\ No newline at end of file
+    # One to many relationship with ChatHistory, deleted by the database's ON DELETE CASCADE
+    # rather than loading every conversation into the session first
+    chat_histories = relationship("ChatHistory", back_populates="pdf", cascade="all, delete-orphan", passive_deletes=True)
+    user = relationship("User", back_populates="pdfs")
+    
+    # Serves the per-user listing, ordered and paginated by (uploaded_date, id)
+    __table_args__ = (
+        Index("ix_pdfs_user_id_uploaded_date_id", "user_id", "uploaded_date", "id"),
+    )
\ No newline at end of file
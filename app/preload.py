@@ -0,0 +1,29 @@
+"""Import what the app otherwise loads on first use, once, before workers fork.
+
+Serving modules import faiss, pypdf, LangChain's integrations and the OpenAI
+SDK lazily so that a worker starts quickly on its own. Under a preloading
+server (see gunicorn.conf.py) the master imports them instead, and forked
+workers share those pages rather than each paying for the import.
+"""
+import importlib
+
+HEAVY_MODULES = [
+    "faiss",
+    "pypdf",
+    "langchain_text_splitters",
+    "langchain_community.vectorstores",
+    "langchain_community.docstore.in_memory",
+    "langchain_community.embeddings",
+    "langchain_community.callbacks.manager",
+    "langchain_community.llms.openai",
+    "openai",
+    "app.services.fake_llm",
+]
+
+
+def preload_libraries():
+    for name in HEAVY_MODULES:
+        importlib.import_module(name)
+    # Forked workers inherit the loaded tokenizer instead of each fetching it
+    from app.services.token_service import get_encoding
+    get_encoding()
@@ -1,30 +1,32 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Response
-from sqlalchemy.orm import Session
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, status, Response, Cookie
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.db import get_db
+from app.db import get_async_db
 from app.models.user_model import User
 from app.types.auth_type import UserCreate, UserLogin, User as UserSchema
 from app.services.auth_service import (
     authenticate_user, create_user, get_current_user, 
-    create_access_token, ACCESS_TOKEN_EXPIRE_DAYS
+    create_access_token, deactivate_user, ACCESS_TOKEN_EXPIRE_DAYS
 )
+from app.services.principal_cache import principal_cache
 
 router = APIRouter(
     prefix="/auth",
     tags=["authentication"]
 )
 
-@router.post("/register", response_model=dict)
-def register_user(user: UserCreate, db: Session = Depends(get_db)):
-    return create_user(db=db, user=user)
+@router.post("/register", response_model=UserSchema)
+async def register_user(user: UserCreate, db: AsyncSession = Depends(get_async_db)):
+    return await create_user(db=db, user=user)
 
 @router.post("/login", response_model=dict)
-def login(
+async def login(
     user_data: UserLogin,
     response: Response,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    user = authenticate_user(db, user_data.email, user_data.password)
+    user = await authenticate_user(db, user_data.email, user_data.password)
     if not user:
         raise HTTPException(
             status_code=401,
@@ -53,11 +55,28 @@ def login(
     }
 
 @router.post("/logout")
-def logout(response: Response):
+def logout(response: Response, token: Optional[str] = Cookie(None, alias="auth_token")):
+    if token:
+        principal_cache.invalidate_token(token)
     response.delete_cookie("auth_token")
     
     return {"message": "Logout successful"}
 
+@router.post("/deactivate")
+async def deactivate(
+    response: Response,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_user)
+):
+    await deactivate_user(db, current_user.id)
+    response.delete_cookie("auth_token")
+    
+    return {"message": "Account deactivated"}
+
+@router.get("/cache/stats")
+def get_auth_cache_stats(current_user: User = Depends(get_current_user)):
+    return principal_cache.stats()
+
 @router.get("/me", response_model=UserSchema)
 def read_users_me(current_user: User = Depends(get_current_user)):
     return current_user
\ No newline at end of file
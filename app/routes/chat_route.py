@@ -1,135 +1,352 @@
-import pickle
-import datetime
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException
+import json
+from contextlib import nullcontext
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select, tuple_
 from sqlalchemy.orm import Session
-from sqlalchemy.orm.attributes import flag_modified
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import SQLAlchemyError
-from langchain_community.llms.openai import OpenAI
-from langchain.prompts import PromptTemplate
-from langchain.chains import RetrievalQA
-from langchain_community.callbacks.manager import get_openai_callback
 
-from app.db import get_db
+from app.config import settings
+from app.db import get_db, get_async_db, AsyncSessionLocal
 from app.models.chat_history_model import ChatHistory
+from app.models.chat_message_model import ChatMessage
 from app.models.user_model import User
-from app.models.pdf_model import PDF
-from app.types.chat_type import Question, ConversationResponse
-from app.services.auth_service import get_current_user, verify_user_owns_pdf
+from app.models.pdf_model import PDF, PDFStatus
+from app.types.chat_type import Question, SourceResponse, ConversationResponse, ChatMessageResponse, ChatMessagePage
+from app.services.auth_service import get_current_user, verify_user_owns_pdf, averify_user_owns_pdf
+from app.services.kb_cache import kb_cache, get_knowledge_base
+from app.services.answer_cache import answer_cache, answer_cache_key, retrieval_variant
+from app.services.pagination import encode_cursor, decode_cursor
+from app.services.chat_service import (
+    LIBRARY_DOCUMENT_PROMPT, build_prompt_inputs, get_or_create_conversation,
+    get_or_create_library_conversation, save_message
+)
+from app.services.memory_service import condense_question
+from app.services.library_index import search_library
+from app.services.embedding_service import get_embeddings
+from app.services.llm_service import LLMRegistry, get_llm_registry, usage_callback
+from app.services.executor_service import run_blocking
+from app.services.metrics_service import timed, record_error, record_llm_usage, record_context_packing
+from app.services.upstream_scheduler import upstream_scheduler, flight_key, UpstreamBusy, busy_error
 
 router = APIRouter(
     prefix="/chat",
     tags=["chat"]
 )
 
+async def load_ready_knowledge_base(question: Question, current_user: User, db: AsyncSession):
+    if not question.question.strip():
+        raise HTTPException(status_code=400, detail="Question cannot be empty")
+
+    with timed("chat", "ownership"):
+        pdf_record = await averify_user_owns_pdf(question.pdf_id, current_user, db)
+    if pdf_record.status not in PDFStatus.SEARCHABLE:
+        raise HTTPException(status_code=409, detail=f"PDF is not ready for questions (status: {pdf_record.status})")
+    
+    # Load the knowledge base, reusing the deserialized copy when this worker has one
+    with timed("chat", "kb_load"):
+        knowledge_base = await get_knowledge_base(pdf_record, db)
+    if knowledge_base is None:
+        raise HTTPException(status_code=404, detail="Knowledge base not found for this PDF")
+    return pdf_record, knowledge_base
+
+async def embed_question(embeddings, query: str, user_id: str):
+    # Embed once with the index's own model; the vector serves both the answer
+    # cache lookup and the similarity search. The same question asked concurrently
+    # is embedded once
+    with timed("chat", "embed"):
+        return await upstream_scheduler.run(
+            lambda: run_blocking(embeddings.embed_query, query), user_id, key=flight_key("embed", query)
+        )
+
+async def generate_answer(llm_registry: LLMRegistry, inputs: dict, user_id: str):
+    # Identical prompts in flight at once share a single completion
+    return await upstream_scheduler.run(
+        lambda: llm_registry.qa_chain.ainvoke(inputs), user_id, key=flight_key("answer", inputs)
+    )
+
+async def retrieve_documents(knowledge_base, question: Question, query: str, query_vector):
+    # Hybrid FAISS + BM25 search and re-ranking block, so they run on the bounded executor
+    k = question.k or settings.RETRIEVAL_K
+    with timed("chat", "retrieval"):
+        return await run_blocking(knowledge_base.search, query, query_vector, k)
+
+async def resolve_question(question: Question, conversation: ChatHistory, db: AsyncSession, llm_registry: LLMRegistry, user_id: str):
+    # In conversational mode a follow-up is rewritten into a standalone question from
+    # the conversation's bounded memory; otherwise the question is used as asked
+    if not question.conversational:
+        return question.question, None
+    with timed("chat", "memory"):
+        return await condense_question(db, conversation, question.question, llm_registry, user_id)
+
+async def load_library(question: Question, current_user: User, db: AsyncSession):
+    if not question.question.strip():
+        raise HTTPException(status_code=400, detail="Question cannot be empty")
+
+    # One metadata query for the whole library; it decides which documents are searched
+    with timed("chat", "ownership"):
+        rows = (await db.execute(
+            select(PDF.id, PDF.name, PDF.index_key, PDF.status).where(PDF.user_id == current_user.id)
+        )).all()
+    owned = {row.id: row for row in rows}
+    
+    pdf_ids = None
+    if question.pdf_ids != "all":
+        pdf_ids = list(dict.fromkeys(question.pdf_ids))
+        for pdf_id in pdf_ids:
+            if pdf_id not in owned:
+                raise HTTPException(status_code=404, detail=f"PDF {pdf_id} not found")
+            if owned[pdf_id].status not in PDFStatus.SEARCHABLE:
+                raise HTTPException(status_code=409, detail=f"PDF {pdf_id} is not ready for questions (status: {owned[pdf_id].status})")
+            if not owned[pdf_id].index_key:
+                raise HTTPException(status_code=409, detail=f"PDF {pdf_id} was uploaded before library search existed; upload it again to include it")
+    
+    ready_pdfs = {
+        row.id: (row.name, row.index_key) for row in rows
+        if row.status in PDFStatus.SEARCHABLE and row.index_key
+    }
+    if pdf_ids is not None:
+        ready_pdfs = {pdf_id: ready_pdfs[pdf_id] for pdf_id in pdf_ids}
+    if not ready_pdfs:
+        raise HTTPException(status_code=404, detail="No ready PDFs to search")
+    return ready_pdfs
+
+async def answer_from_library(question: Question, current_user: User, db: AsyncSession, llm_registry: LLMRegistry):
+    members = await load_library(question, current_user, db)
+    conversation = await get_or_create_library_conversation(db, current_user.id)
+    query, memory = await resolve_question(question, conversation, db, llm_registry, current_user.id)
+    
+    # A single search over the user's library index, restricted to the requested documents
+    query_vector = await embed_question(get_embeddings(), query, current_user.id)
+    with timed("chat", "retrieval"):
+        documents = await run_blocking(search_library, current_user.id, members, query_vector, question.k or settings.RETRIEVAL_K)
+    
+    inputs, documents, usage = build_prompt_inputs(query, documents, LIBRARY_DOCUMENT_PROMPT)
+    
+    with timed("chat", "llm"), usage_callback() as cb:
+        response = await generate_answer(llm_registry, inputs, current_user.id)
+    usage = usage_report({**usage, **(memory or {})}, cb)
+    
+    with timed("chat", "persist"):
+        await save_message(db, conversation.id, question.question, response)
+    
+    sources = {}
+    for document in documents:
+        key = (document.metadata["pdf_id"], document.metadata["page"])
+        sources.setdefault(key, SourceResponse(
+            pdf_id=document.metadata["pdf_id"],
+            name=document.metadata["source"],
+            page=document.metadata["page"]
+        ))
+    return {
+        "answer": response,
+        "conversation_id": conversation.id,
+        "cached": False,
+        "sources": list(sources.values()),
+        "usage": usage
+    }
+
+def usage_report(usage: dict, cb) -> dict:
+    # Our prompt-packing numbers next to what OpenAI reported for the call
+    record_llm_usage("answer", cb)
+    record_context_packing(usage)
+    return {
+        **usage,
+        "cached": False,
+        "openai_prompt_tokens": cb.prompt_tokens,
+        "openai_completion_tokens": cb.completion_tokens,
+        "openai_total_cost": cb.total_cost
+    }
+
+def cached_usage(memory: Optional[dict]) -> dict:
+    # The shape of usage_report for an answer served from the cache: nothing was
+    # retrieved or sent to OpenAI for it, though conversational memory may have been
+    return {
+        "chunks_retrieved": 0,
+        "chunks_packed": 0,
+        "dropped_redundant": 0,
+        "dropped_over_budget": 0,
+        "context_tokens": 0,
+        "context_budget": settings.CONTEXT_TOKEN_BUDGET,
+        "prompt_tokens": 0,
+        **(memory or {}),
+        "cached": True,
+        "openai_prompt_tokens": 0,
+        "openai_completion_tokens": 0,
+        "openai_total_cost": 0.0
+    }
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
 @router.post('/')
 async def question_and_answer(
     question: Question,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_user),
+    llm_registry: LLMRegistry = Depends(get_llm_registry)
 ):
     try:
-        if not question.question.strip():
-            raise HTTPException(status_code=400, detail="Question cannot be empty")
-
-        pdf_record = verify_user_owns_pdf(question.pdf_id, current_user, db)
+        if question.pdf_ids is not None:
+            return await answer_from_library(question, current_user, db, llm_registry)
         
-        # Load the knowledge base from the PDF record
-        knowledge_base = pickle.loads(pdf_record.content)
+        pdf_record, knowledge_base = await load_ready_knowledge_base(question, current_user, db)
+        cache_key = answer_cache_key(pdf_record)
+        conversation = await get_or_create_conversation(db, question.pdf_id)
+        query, memory = await resolve_question(question, conversation, db, llm_registry, current_user.id)
         
-        # Check if the conversation already exists
-        conversation = db.query(ChatHistory).filter(
-            ChatHistory.pdf_id == question.pdf_id
-        ).first()
+        # A near-identical question about the same document skips retrieval and the LLM
+        query_vector = await embed_question(knowledge_base.embeddings, query, current_user.id)
+        variant = retrieval_variant(question.k or settings.RETRIEVAL_K)
+        response = answer_cache.get(cache_key, query_vector, variant)
+        cached = response is not None
+        usage = cached_usage(memory) if cached else None
         
-        # If no conversation exists, create a new one
-        if not conversation:
-            conversation = ChatHistory(
-                pdf_id=question.pdf_id,
-                conversation=[]
-            )
-            db.add(conversation)
-            db.commit()
-            db.refresh(conversation)
-            print("New conversation created:", conversation.id)
-        else:
-            pdf = db.query(PDF).filter(PDF.id == conversation.pdf_id).first()
-            if pdf.user_id != current_user.id:
-                raise HTTPException(status_code=403, detail='Not authorized to access this conversation')
-            print("Existing conversation:", conversation.conversation)
-        
-        llm = OpenAI(model="gpt-3.5-turbo-instruct")
+        if not cached:
+            # Retrieve the most relevant chunks and answer from them with the "stuff" approach,
+            # packed into the context token budget
+            documents = await retrieve_documents(knowledge_base, question, query, query_vector)
+            inputs, _, usage = build_prompt_inputs(query, documents)
+            
+            with timed("chat", "llm"), usage_callback() as cb:
+                response = await generate_answer(llm_registry, inputs, current_user.id)
+            usage = usage_report({**usage, **(memory or {})}, cb)
+            answer_cache.put(cache_key, query, query_vector, response, variant)
         
-        # Define the prompt template
-        prompt_template = PromptTemplate(
-                input_variables=["context", "question"],
-                template="""You are an intelligent assistant helping a user understand information from their PDF document.
-
-            Instructions:
-            - Carefully analyze the provided context from the PDF document.
-            - Answer the user's question based ONLY on the information provided in the context.
-            - If the answer is fully contained in the context, provide a clear, concise response.
-            - If the answer is partially in the context, provide what you can find and indicate what information is missing.
-            - If the answer is not in the context at all, politely state that the information isn't present in the provided sections.
-            - Do not make up information or use knowledge outside of the provided context.
-            - If the context is ambiguous or unclear, acknowledge this and explain what's confusing.
-            - For complex questions, break down your answer into structured parts.
-            - When referencing specific parts of the document, indicate where the information came from (e.g., "According to page 5..." or "In the section about...").
-            - If the user asks for a summary, focus on key points rather than every detail.
-
-            Context from PDF: {context}
-
-            User Question: {question}
-
-            Answer:"""
-            )
-                    
-                    # Create the retriever with a search method
-        retriever = knowledge_base.as_retriever(search_kwargs={"k": 4})
-        
-        # Create the QA chain with the LLM and retriever
-        # Use the "stuff" chain type for simplicity
-        qa_chain = RetrievalQA.from_chain_type(
-            llm=llm,
-            chain_type="stuff",
-            retriever=retriever,
-            return_source_documents=False,
-            chain_type_kwargs={"prompt": prompt_template}
-        )
-        
-        # This is for debugging purposes, to see total tokens used and cost
-        with get_openai_callback() as cb:
-            result = qa_chain.invoke({"query": question.question})
-            response = result["result"]
-            print(f"OpenAI API usage: {cb}")
-        
-        # Append the new question and answer to the conversation
-        conversation.conversation.append({
-            "user": question.question,
-            "ai": response,
-            "timestamp": datetime.datetime.utcnow().isoformat()
-        })
-        # Update the conversation in the database
-        flag_modified(conversation, "conversation")
-        db.commit()
-        print("After commit:", db.query(ChatHistory).filter(ChatHistory.id == conversation.id).first().conversation)
+        with timed("chat", "persist"):
+            await save_message(db, conversation.id, question.question, response)
         
         return {
             "answer": response,
-            "conversation_id": conversation.id
+            "conversation_id": conversation.id,
+            "cached": cached,
+            "usage": usage
         }
         
     except SQLAlchemyError as db_error:
-        db.rollback()
-        print(f"Database error: {str(db_error)}")
+        await db.rollback()
+        record_error("chat", db_error, pdf_id=question.pdf_id or question.pdf_ids)
         raise HTTPException(status_code=500, detail=f"Database error: {str(db_error)}")
+    except UpstreamBusy as busy:
+        raise busy_error(busy)
     except HTTPException as http_error:
         raise http_error
     except Exception as error:
-        db.rollback()
-        print(f"Error in /chat endpoint: {str(error)}")
+        await db.rollback()
+        record_error("chat", error, pdf_id=question.pdf_id or question.pdf_ids)
         raise HTTPException(status_code=500, detail=f"Server error: {str(error)}")
 
+@router.post('/stream')
+async def stream_question_and_answer(
+    question: Question,
+    request: Request,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_user),
+    llm_registry: LLMRegistry = Depends(get_llm_registry)
+):
+    if question.pdf_ids is not None:
+        raise HTTPException(status_code=400, detail="Streaming answers take a single pdf_id; use POST /chat/ for pdf_ids")
+    
+    # Everything that can fail with a proper status code happens before the stream opens
+    try:
+        pdf_record, knowledge_base = await load_ready_knowledge_base(question, current_user, db)
+        cache_key = answer_cache_key(pdf_record)
+        conversation = await get_or_create_conversation(db, question.pdf_id)
+        conversation_id = conversation.id
+        query, memory = await resolve_question(question, conversation, db, llm_registry, current_user.id)
+        query_vector = await embed_question(knowledge_base.embeddings, query, current_user.id)
+        variant = retrieval_variant(question.k or settings.RETRIEVAL_K)
+        cached_answer = answer_cache.get(cache_key, query_vector, variant)
+        documents = [] if cached_answer is not None else await retrieve_documents(knowledge_base, question, query, query_vector)
+        if cached_answer is None:
+            # Refuse now, while a status code can still be sent, rather than inside the stream
+            upstream_scheduler.check_queue()
+    except SQLAlchemyError as db_error:
+        await db.rollback()
+        record_error("chat", db_error, pdf_id=question.pdf_id)
+        raise HTTPException(status_code=500, detail=f"Database error: {str(db_error)}")
+    except UpstreamBusy as busy:
+        raise busy_error(busy)
+    except HTTPException as http_error:
+        raise http_error
+    except Exception as error:
+        record_error("chat", error, pdf_id=question.pdf_id)
+        raise HTTPException(status_code=500, detail=f"Server error: {str(error)}")
+    
+    qa_chain = llm_registry.qa_chain
+    user_id = current_user.id
+    inputs, _, usage = build_prompt_inputs(query, documents)
+    usage = {**usage, **(memory or {})}
+    
+    async def cached_stream():
+        # The whole answer is already known, so it goes out as a single token event
+        yield cached_answer
+    
+    async def event_stream():
+        tokens = []
+        stream = cached_stream() if cached_answer is not None else qa_chain.astream(inputs)
+        # A streamed answer holds its admission until the last token
+        slot = upstream_scheduler.slot(user_id) if cached_answer is None else nullcontext()
+        try:
+            # Covers generation and sending, since tokens go out as they arrive
+            async with slot:
+                with timed("chat", "llm" if cached_answer is None else "cached_answer"), usage_callback() as cb:
+                    async for token in stream:
+                        # Stop generating, and stop paying for tokens, once nobody is listening
+                        if await request.is_disconnected():
+                            return
+                        tokens.append(token)
+                        yield sse_event("token", {"token": token})
+        except UpstreamBusy as busy:
+            yield sse_event("error", {"detail": "Too many questions are waiting for the language model", "retry_after": busy.retry_after})
+            return
+        except Exception as error:
+            record_error("chat", error, pdf_id=question.pdf_id)
+            yield sse_event("error", {"detail": f"Server error: {str(error)}"})
+            return
+        finally:
+            # Closing the generator closes the upstream LLM request, including when
+            # the client disconnects and the response task is cancelled
+            await stream.aclose()
+        
+        # The request's session is closed once the response starts, so persist with a fresh one
+        answer = "".join(tokens)
+        if cached_answer is None:
+            report = usage_report(usage, cb)
+            answer_cache.put(cache_key, query, query_vector, answer, variant)
+        else:
+            report = cached_usage(memory)
+        async with AsyncSessionLocal() as stream_db:
+            try:
+                with timed("chat", "persist"):
+                    await save_message(stream_db, conversation_id, question.question, answer)
+            except SQLAlchemyError as db_error:
+                await stream_db.rollback()
+                yield sse_event("error", {"detail": f"Database error: {str(db_error)}"})
+                return
+        
+        yield sse_event("done", {
+            "answer": answer,
+            "conversation_id": conversation_id,
+            "cached": cached_answer is not None,
+            "usage": report
+        })
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def message_to_turn(message):
+    return {
+        "user": message.question,
+        "ai": message.answer,
+        "timestamp": message.created_at.isoformat()
+    }
+
 @router.get('/conversations/{pdf_id}', response_model=List[ConversationResponse])
 def get_conversations(
     pdf_id: str,
@@ -144,11 +361,93 @@ def get_conversations(
             ConversationResponse(
                 id=conv.id,
                 pdf_id=conv.pdf_id,
-                conversation=conv.conversation,
+                conversation=[
+                    message_to_turn(message) for message in db.query(ChatMessage).filter(
+                        ChatMessage.conversation_id == conv.id
+                    ).order_by(ChatMessage.created_at, ChatMessage.id)
+                ],
                 created_at=conv.created_at
             ) for conv in conversations
         ]
     except HTTPException as http_error:
         raise http_error
     except Exception as error:
-        raise HTTPException(status_code=500, detail=f'Server error: {str(error)}')
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f'Server error: {str(error)}')
+
+def message_page(db: Session, conversation_id: str, limit: int, cursor: Optional[str]) -> ChatMessagePage:
+    # Newest first, each page a bounded range scan on (conversation_id, created_at, id);
+    # pass next_cursor back to fetch older messages
+    query = db.query(ChatMessage).filter(ChatMessage.conversation_id == conversation_id)
+    if cursor:
+        query = query.filter(tuple_(ChatMessage.created_at, ChatMessage.id) < decode_cursor(cursor))
+    messages = query.order_by(ChatMessage.created_at.desc(), ChatMessage.id.desc()).limit(limit + 1).all()
+    
+    next_cursor = None
+    if len(messages) > limit:
+        next_cursor = encode_cursor(messages[limit - 1].created_at, messages[limit - 1].id)
+    return ChatMessagePage(
+        conversation_id=conversation_id,
+        messages=[
+            ChatMessageResponse(
+                id=message.id,
+                question=message.question,
+                answer=message.answer,
+                created_at=message.created_at
+            ) for message in messages[:limit]
+        ],
+        next_cursor=next_cursor
+    )
+
+@router.get('/conversations/{pdf_id}/messages', response_model=ChatMessagePage)
+def get_conversation_messages(
+    pdf_id: str,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    try:
+        verify_user_owns_pdf(pdf_id, current_user, db)
+        
+        conversation = db.query(ChatHistory.id).filter(ChatHistory.pdf_id == pdf_id).first()
+        if not conversation:
+            raise HTTPException(status_code=404, detail='No conversation found for this PDF')
+        
+        return message_page(db, conversation.id, limit, cursor)
+    except HTTPException as http_error:
+        raise http_error
+    except Exception as error:
+        raise HTTPException(status_code=500, detail=f'Server error: {str(error)}')
+
+@router.get('/library/messages', response_model=ChatMessagePage)
+def get_library_messages(
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    try:
+        conversation = db.query(ChatHistory.id).filter(
+            ChatHistory.user_id == current_user.id,
+            ChatHistory.pdf_id.is_(None)
+        ).first()
+        if not conversation:
+            raise HTTPException(status_code=404, detail='No library conversation found')
+        
+        return message_page(db, conversation.id, limit, cursor)
+    except HTTPException as http_error:
+        raise http_error
+    except Exception as error:
+        raise HTTPException(status_code=500, detail=f'Server error: {str(error)}')
+
+@router.get('/kb-cache/stats')
+def get_kb_cache_stats(current_user: User = Depends(get_current_user)):
+    return kb_cache.stats()
+
+@router.get('/answer-cache/stats')
+def get_answer_cache_stats(current_user: User = Depends(get_current_user)):
+    return answer_cache.stats()
+
+@router.get('/scheduler/stats')
+def get_scheduler_stats(current_user: User = Depends(get_current_user)):
+    return upstream_scheduler.stats()
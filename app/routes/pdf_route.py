@@ -1,18 +1,24 @@
-import io
-import pickle
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException, File, UploadFile
-from sqlalchemy.orm import Session
-from pypdf import PdfReader
-from langchain.text_splitter import CharacterTextSplitter
-from langchain_community.embeddings import OpenAIEmbeddings
-from langchain_community.vectorstores import FAISS
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, File, UploadFile, Query
+from sqlalchemy import tuple_
+from sqlalchemy.orm import Session, load_only
 
 from app.db import get_db
-from app.models.pdf_model import PDF
+from app.models.pdf_model import PDF, PDFStatus
 from app.models.user_model import User
-from app.types.pdf_type import PDFResponse
+from app.types.pdf_type import PDFResponse, PDFListResponse, PDFStatusResponse
 from app.services.auth_service import get_current_user, verify_user_owns_pdf
+from app.services.kb_cache import kb_cache, kb_cache_key
+from app.services.answer_cache import answer_cache, answer_cache_key
+from app.services.pagination import encode_cursor, decode_cursor
+from app.services.ingestion_service import (
+    submit_ingestion, submit_revision, submit_library_sync, job_claim, IngestionQueueFull
+)
+from app.services.metrics_service import timed
+from app.services.upload_service import spool_upload, discard_upload
+from app.services.knowledge_base_service import (
+    find_duplicate_index, acquire_knowledge_base, release_knowledge_base, commit_releases
+)
 
 router = APIRouter(
     prefix="/pdf",
@@ -22,8 +28,8 @@ router = APIRouter(
 def bytes_to_kilobytes(bytes_value):
     return f"{bytes_value / 1024:.2f} KB"
 
-@router.post('/upload', response_model=dict)
-async def pdf_upload(
+@router.post('/upload', response_model=dict, status_code=202)
+def pdf_upload(
     file: UploadFile = File(...),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
@@ -33,78 +39,178 @@ async def pdf_upload(
     if not file.filename.endswith('.pdf'):
         raise HTTPException(status_code=400, detail='Uploaded file must be a PDF')
     
+    pdf_path = None
     try:
-        # Read the PDF file binary data
-        pdf_binary_data = await file.read()
+        # Spool the upload to disk, fingerprinting it on the way
+        with timed("upload", "parse"):
+            pdf_path, size, fingerprint = spool_upload(file)
         
-        file_size = len(pdf_binary_data)
+        # Identical bytes were already ingested: share that knowledge base instead of rebuilding it,
+        # unless a delete freed it since the lookup
+        duplicate_index_key = find_duplicate_index(db, fingerprint)
+        if duplicate_index_key and acquire_knowledge_base(db, duplicate_index_key):
+            pdf_record = PDF(
+                name=file.filename,
+                size=size,
+                fingerprint=fingerprint,
+                index_key=duplicate_index_key,
+                status=PDFStatus.READY,
+                user_id=current_user.id
+            )
+            db.add(pdf_record)
+            db.commit()
+            submit_library_sync(current_user.id, pdf_record.id)
+            
+            return {
+                "id": pdf_record.id,
+                "job_id": pdf_record.id,
+                "status": pdf_record.status,
+                "msg": 'PDF uploaded and knowledge base created successfully'
+            }
         
-        pdf = io.BytesIO(pdf_binary_data)
-        # Use PyPDF2 to read the PDF content
-        pdf_content = PdfReader(pdf)
-
-        text = ''
-        for i in pdf_content.pages:
-            text += i.extract_text()
-
-
-
-        # Split the text into chunks
-        text_splitter = CharacterTextSplitter(
-            separator='\n',
-            chunk_size=2000,
-            chunk_overlap=200,
-            length_function=len
-        )
-        chunks = text_splitter.split_text(text)
-        print(f"Number of chunks: {len(chunks)}")
-
-        # Create embeddings and knowledge base
-        embeddings = OpenAIEmbeddings()
-
-#        # Create a FAISS knowledge base from the chunks
-        knowledge_base = FAISS.from_texts(chunks, embeddings)
-        
-        # Save the knowledge base to a file or database
-        serialized_kb = pickle.dumps(knowledge_base)
-        
-        print("serialized_kb:", serialized_kb[:100])
-        # Store the PDF and knowledge base in the database  
+        # Store the PDF metadata now; the knowledge base is built in the background
         pdf_record = PDF(
             name=file.filename,
-            size=file_size,
-            content=serialized_kb,
-            user_id=current_user.id 
+            size=size,
+            fingerprint=fingerprint,
+            status=PDFStatus.QUEUED,
+            user_id=current_user.id,
+            **job_claim(pdf_path)
         )
         
-        db.add(pdf_record)
-        db.commit()
-        db.refresh(pdf_record)
+        with timed("upload", "db_write"):
+            db.add(pdf_record)
+            db.commit()
+            db.refresh(pdf_record)
+        
+        try:
+            submit_ingestion(pdf_record.id, pdf_path)
+            pdf_path = None
+        except IngestionQueueFull as full:
+            db.delete(pdf_record)
+            db.commit()
+            raise HTTPException(
+                status_code=503,
+                detail='Too many PDFs are being processed, please try again shortly',
+                headers={"Retry-After": str(full.retry_after)}
+            )
         
         return {
             "id": pdf_record.id,
-            "msg": 'PDF uploaded and knowledge base created successfully'
+            "job_id": pdf_record.id,
+            "status": pdf_record.status,
+            "msg": 'PDF uploaded, knowledge base is being created'
         }
 
+    except HTTPException as http_error:
+        raise http_error
     except Exception as error:
         db.rollback()
         raise HTTPException(status_code=500, detail=f'Server error: {str(error)}')
+    finally:
+        if pdf_path:
+            discard_upload(pdf_path)
 
-@router.get('/pdfs', response_model=List[PDFResponse])
+@router.put('/{pdf_id}', response_model=dict, status_code=202)
+def pdf_update(
+    pdf_id: str,
+    file: UploadFile = File(...),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    if not file:
+        raise HTTPException(status_code=400, detail='Please upload a file')
+    if not file.filename.endswith('.pdf'):
+        raise HTTPException(status_code=400, detail='Uploaded file must be a PDF')
+    
+    pdf_path = None
+    try:
+        pdf = verify_user_owns_pdf(pdf_id, current_user, db)
+        if pdf.status != PDFStatus.READY:
+            raise HTTPException(status_code=409, detail=f'PDF cannot be revised while it is {pdf.status}')
+        
+        pdf_path, size, fingerprint = spool_upload(file)
+        if fingerprint == pdf.fingerprint:
+            pdf.name = file.filename
+            db.commit()
+            return {"id": pdf.id, "job_id": pdf.id, "status": pdf.status, "msg": 'PDF is unchanged'}
+        
+        previous = {"name": pdf.name, "fingerprint": pdf.fingerprint, "size": pdf.size, "status": pdf.status, "error": pdf.error}
+        pdf.name = file.filename
+        for column, value in job_claim(pdf_path).items():
+            setattr(pdf, column, value)
+        if pdf.index_key:
+            # Only changed chunks are embedded; questions keep using the current revision meanwhile
+            pdf.status = PDFStatus.UPDATING
+            job_args = (size, fingerprint)
+            submit = submit_revision
+            msg = 'PDF revision is being applied'
+        else:
+            # Uploaded before the vector store existed, so there is nothing to patch: rebuild it
+            pdf.status = PDFStatus.QUEUED
+            pdf.fingerprint = fingerprint
+            pdf.size = size
+            job_args = ()
+            submit = submit_ingestion
+            msg = 'PDF uploaded, knowledge base is being created'
+        pdf.error = None
+        db.commit()
+        
+        try:
+            submit(pdf.id, pdf_path, *job_args)
+            pdf_path = None
+        except IngestionQueueFull as full:
+            db.query(PDF).filter(PDF.id == pdf_id).update(previous, synchronize_session=False)
+            db.commit()
+            raise HTTPException(
+                status_code=503,
+                detail='Too many PDFs are being processed, please try again shortly',
+                headers={"Retry-After": str(full.retry_after)}
+            )
+        
+        return {"id": pdf.id, "job_id": pdf.id, "status": pdf.status, "msg": msg}
+    
+    except HTTPException as http_error:
+        raise http_error
+    except Exception as error:
+        db.rollback()
+        raise HTTPException(status_code=500, detail=f'Server error: {str(error)}')
+    finally:
+        if pdf_path:
+            discard_upload(pdf_path)
+
+@router.get('/pdfs', response_model=PDFListResponse)
 def get_pdfs(
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
     try:
-        pdfs = db.query(PDF).filter(PDF.user_id == current_user.id).all()
-        return [
-            PDFResponse(
-                id=pdf.id,
-                name=pdf.name,
-                size=bytes_to_kilobytes(pdf.size),
-                uploaded_date=pdf.uploaded_date
-            ) for pdf in pdfs
-        ]
+        # Keyset pagination over (uploaded_date, id), newest first, so each page is a
+        # bounded range scan on ix_pdfs_user_id_uploaded_date_id however many PDFs exist
+        query = db.query(PDF).options(
+            load_only(PDF.id, PDF.name, PDF.size, PDF.uploaded_date, PDF.status)
+        ).filter(PDF.user_id == current_user.id)
+        if cursor:
+            query = query.filter(tuple_(PDF.uploaded_date, PDF.id) < decode_cursor(cursor))
+        pdfs = query.order_by(PDF.uploaded_date.desc(), PDF.id.desc()).limit(limit + 1).all()
+        
+        next_cursor = encode_cursor(pdfs[limit - 1].uploaded_date, pdfs[limit - 1].id) if len(pdfs) > limit else None
+        return PDFListResponse(
+            items=[
+                PDFResponse(
+                    id=pdf.id,
+                    name=pdf.name,
+                    size=bytes_to_kilobytes(pdf.size),
+                    uploaded_date=pdf.uploaded_date,
+                    status=pdf.status
+                ) for pdf in pdfs[:limit]
+            ],
+            next_cursor=next_cursor
+        )
+    except HTTPException as http_error:
+        raise http_error
     except Exception as error:
         raise HTTPException(status_code=500, detail=f'Server error: {str(error)}')
 
@@ -121,7 +227,27 @@ def get_single_pdf(
             id=pdf.id,
             name=pdf.name,
             size=bytes_to_kilobytes(pdf.size),
-            uploaded_date=pdf.uploaded_date
+            uploaded_date=pdf.uploaded_date,
+            status=pdf.status
+        )
+    except HTTPException as http_error:
+        raise http_error
+    except Exception as error:
+        raise HTTPException(status_code=500, detail=f'Server error: {str(error)}')
+
+@router.get('/{pdf_id}/status', response_model=PDFStatusResponse)
+def get_pdf_status(
+    pdf_id: str,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    try:
+        pdf = verify_user_owns_pdf(pdf_id, current_user, db)
+        
+        return PDFStatusResponse(
+            id=pdf.id,
+            status=pdf.status,
+            error=pdf.error
         )
     except HTTPException as http_error:
         raise http_error
@@ -136,9 +262,22 @@ def delete_pdf(
 ):
     try:
         pdf = verify_user_owns_pdf(pdf_id, current_user, db)
+        index_key = pdf.index_key
+        cache_key = answer_cache_key(pdf)
+        kb_key = kb_cache_key(pdf)
         
         db.delete(pdf)
-        db.commit()
+        db.flush()
+        # Identical documents share one stored index, so only free it with its last owner
+        freed = release_knowledge_base(db, index_key) if index_key else False
+        commit_releases(db, [index_key] if freed else [])
+        
+        # A shared index, and answers from it, stay valid while another copy of the document exists
+        if freed or not index_key:
+            kb_cache.invalidate(kb_key)
+            answer_cache.invalidate(cache_key)
+        if index_key:
+            submit_library_sync(current_user.id, pdf_id)
         
         return {"msg": "PDF and associated conversations deleted successfully"}
     except HTTPException as http_error:
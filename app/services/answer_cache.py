@@ -0,0 +1,156 @@
+import time
+import threading
+from collections import OrderedDict
+from typing import List, Optional
+
+import numpy as np
+
+from app.config import settings
+
+
+class AnswerCache:
+    """Per-worker cache of answers, keyed by knowledge base and question embedding.
+
+    A question hits when an unexpired answer exists for the same knowledge base
+    and retrieval variant whose question embedding has cosine similarity >=
+    `threshold`. Entries
+    expire after `ttl` seconds and the least recently used is evicted once
+    `max_entries` is reached.
+    """
+
+    def __init__(self, max_entries: int, ttl: float, threshold: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.threshold = threshold
+        self._entries = OrderedDict()  # (cache_key, variant, question) -> (unit vector, answer, expires_at)
+        self._by_key = {}  # cache_key -> {variant: _Group}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, cache_key: str, question_vector: List[float], variant: str = "") -> Optional[str]:
+        vector = _unit(question_vector)
+        now = time.monotonic()
+        with self._lock:
+            best_entry = None
+            group = self._by_key.get(cache_key, {}).get(variant)
+            if group is not None:
+                # One matrix product scores every cached question for this knowledge base
+                order, matrix, expires = self._stacked(group)
+                scores = matrix @ vector
+                live = expires > now
+                scores[~live] = -np.inf
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    best_entry = order[best]
+                for position in np.flatnonzero(~live):
+                    self._remove(order[position])
+                    self.expirations += 1
+            if best_entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best_entry)
+            self.hits += 1
+            return self._entries[best_entry][1]
+
+    def put(self, cache_key: str, question: str, question_vector: List[float], answer: str, variant: str = ""):
+        if self.max_entries <= 0:
+            return
+        entry_key = (cache_key, variant, question.strip())
+        with self._lock:
+            self._remove(entry_key)
+            self._entries[entry_key] = (_unit(question_vector), answer, time.monotonic() + self.ttl)
+            group = self._by_key.setdefault(cache_key, {}).setdefault(variant, _Group())
+            group.keys[entry_key] = None
+            group.stacked = None
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, cache_key: str):
+        with self._lock:
+            for group in list(self._by_key.get(cache_key, {}).values()):
+                for entry_key in list(group.keys):
+                    self._remove(entry_key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_key.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "similarity_threshold": self.threshold,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+    def _stacked(self, group: "_Group"):
+        if group.stacked is None:
+            order = list(group.keys)
+            entries = [self._entries[entry_key] for entry_key in order]
+            group.stacked = (
+                order,
+                np.stack([vector for vector, _, _ in entries]),
+                np.array([expires_at for _, _, expires_at in entries])
+            )
+        return group.stacked
+
+    def _remove(self, entry_key):
+        if self._entries.pop(entry_key, None) is None:
+            return
+        cache_key, variant, _ = entry_key
+        groups = self._by_key[cache_key]
+        group = groups[variant]
+        del group.keys[entry_key]
+        group.stacked = None
+        if not group.keys:
+            del groups[variant]
+            if not groups:
+                del self._by_key[cache_key]
+
+
+class _Group:
+    """The cached questions for one knowledge base and retrieval variant."""
+
+    def __init__(self):
+        self.keys = {}  # entry keys, in insertion order
+        self.stacked = None  # (entry keys, unit vectors, expiry times), rebuilt after any change
+
+
+def _unit(vector: List[float]) -> np.ndarray:
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def answer_cache_key(pdf_record) -> str:
+    # Indexes are content-addressed, so identical documents share cached answers;
+    # legacy rows without an index fall back to their own id
+    return pdf_record.index_key or f"pdf:{pdf_record.id}"
+
+
+def retrieval_variant(k: int) -> str:
+    # Answers built from a different number of chunks, or chunks chosen differently,
+    # are not interchangeable even for the same question
+    return (
+        f"k={k};fetch_k={settings.RETRIEVAL_FETCH_K};rrf_k={settings.RRF_K};"
+        f"reranker={settings.RERANKER}:{settings.RERANKER_MODEL};context={settings.CONTEXT_TOKEN_BUDGET}"
+    )
+
+
+answer_cache = AnswerCache(
+    max_entries=settings.ANSWER_CACHE_MAX_ENTRIES,
+    ttl=settings.ANSWER_CACHE_TTL,
+    threshold=settings.ANSWER_CACHE_SIMILARITY
+)
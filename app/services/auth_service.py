@@ -1,20 +1,26 @@
 from datetime import datetime, timedelta
 from typing import Optional
 from passlib.context import CryptContext
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from jose import JWTError
 from jose import jwt
 from fastapi import HTTPException, status, Cookie, Depends
 from fastapi import Depends, HTTPException, status
 from sqlalchemy.orm import Session
 
-from app.services.auth_service import get_current_user
 from app.models.user_model import User
 from app.types.auth_type import UserCreate
-from app.db import get_db
+from app.db import get_db, get_async_db
 from app.config import settings
+from app.services.principal_cache import principal_cache, user_snapshot
+from app.services.executor_service import run_password_hash
+from app.services.metrics_service import timed
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Hashes made with other rounds still verify, and are flagged for rehashing
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=settings.BCRYPT_ROUNDS)
 
 SECRET_KEY = settings.SECRET_KEY
 ALGORITHM = settings.ALGORITHM
@@ -26,15 +32,31 @@ def verify_password(plain_password, hashed_password):
 def get_password_hash(password):
     return pwd_context.hash(password)
 
+# bcrypt costs tens to hundreds of milliseconds of CPU, so request handlers
+# hash and verify on the bounded password executor, never on the event loop
+async def aget_password_hash(password):
+    return await run_password_hash(pwd_context.hash, password)
+
+async def averify_and_update_password(plain_password, hashed_password):
+    return await run_password_hash(pwd_context.verify_and_update, plain_password, hashed_password)
+
 def get_user_by_email(db: Session, email: str):
     return db.query(User).filter(User.email == email).first()
 
-def authenticate_user(db: Session, email: str, password: str):
-    user = get_user_by_email(db, email)
-    if not user:
+async def aget_user_by_email(db: AsyncSession, email: str):
+    return (await db.execute(select(User).where(User.email == email).limit(1))).scalar()
+
+async def authenticate_user(db: AsyncSession, email: str, password: str):
+    user = await aget_user_by_email(db, email)
+    if not user or user.is_active is False:
         return False
-    if not verify_password(password, user.hashed_password):
+    valid, new_hash = await averify_and_update_password(password, user.hashed_password)
+    if not valid:
         return False
+    if new_hash:
+        # Hashed with other parameters than BCRYPT_ROUNDS; the plaintext is only known now
+        user.hashed_password = new_hash
+        await db.commit()
     return user
 
 def create_access_token(data: dict):
@@ -44,26 +66,35 @@ def create_access_token(data: dict):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def create_user(db: Session, user: UserCreate):
-    db_user = get_user_by_email(db, user.email)
-    if db_user:
-        raise HTTPException(status_code=400, detail="Email already registered, please try another one.")
+async def create_user(db: AsyncSession, user: UserCreate):
+    email_taken = HTTPException(status_code=400, detail="Email already registered, please try another one.")
+    if await aget_user_by_email(db, user.email):
+        raise email_taken
     
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await aget_password_hash(user.password)
     db_user = User(
         email=user.email,
         full_name=user.full_name,
         hashed_password=hashed_password
     )
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    try:
+        await db.commit()
+    except IntegrityError:
+        # Another registration for the same email won the race while this one was hashing
+        await db.rollback()
+        raise email_taken
+    await db.refresh(db_user)
     return db_user
 
 async def get_current_user(
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     token: Optional[str] = Cookie(None, alias="auth_token")
 ):
+    with timed("request", "auth"):
+        return await user_for_token(db, token)
+
+async def user_for_token(db: AsyncSession, token: Optional[str]):
     credentials_exception = HTTPException(
         status_code=401,
         detail="User not authenticated. Please login.",
@@ -72,6 +103,11 @@ async def get_current_user(
     if not token:
         raise credentials_exception
     
+    # A recently verified token skips both the JWT decode and the user query
+    user = principal_cache.get(token)
+    if user is not None:
+        return user
+    
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         user_id: str = payload.get("id")
@@ -80,17 +116,36 @@ async def get_current_user(
     except JWTError:
         raise credentials_exception
     
-    user = db.query(User).filter(User.id == user_id).first()
+    user = await db.get(User, user_id)
     if user is None:
         raise credentials_exception
+    if user.is_active is False:
+        raise HTTPException(status_code=403, detail="User account is deactivated")
     
+    user = user_snapshot(user)
+    principal_cache.put(token, user, payload.get("exp"))
     return user
 
+async def deactivate_user(db: AsyncSession, user_id: str):
+    await db.execute(update(User).where(User.id == user_id).values(is_active=False))
+    await db.commit()
+    # Drop this worker's cached sessions at once; other workers expire theirs within AUTH_CACHE_TTL
+    principal_cache.invalidate_user(user_id)
+
 
 
 def verify_user_owns_pdf(pdf_id: str, current_user: User, db: Session):
     from app.models.pdf_model import PDF
     pdf = db.query(PDF).filter(PDF.id == pdf_id).first()
+    if not pdf:
+        raise HTTPException(status_code=404, detail="PDF not found")
+    if pdf.user_id != current_user.id:
+        raise HTTPException(status_code=403, detail="Not authorized to access this PDF")
+    return pdf
+
+async def averify_user_owns_pdf(pdf_id: str, current_user: User, db: AsyncSession):
+    from app.models.pdf_model import PDF
+    pdf = await db.get(PDF, pdf_id)
     if not pdf:
         raise HTTPException(status_code=404, detail="PDF not found")
     if pdf.user_id != current_user.id:
@@ -0,0 +1,77 @@
+import re
+import math
+from collections import Counter
+from typing import Dict, List, Tuple
+
+# Keep dotted and hyphenated identifiers whole, so "3.1" and "SKU-00042" stay single terms
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[.\-/][a-z0-9]+)*")
+
+
+def tokenize(text: str) -> List[str]:
+    tokens = TOKEN_PATTERN.findall(text.lower())
+    # Also index the parts of compound tokens, so "sku 42" style queries still match
+    parts = [part for token in tokens if not token.isalnum() for part in re.split(r"[.\-/]", token)]
+    return tokens + parts
+
+
+class BM25Index:
+    """Inverted index over a knowledge base's chunks, scored with Okapi BM25.
+
+    Chunks are addressed by their position in the FAISS index, so lexical and
+    vector hits refer to the same documents. Postings are stored flat as
+    [position, term frequency, position, term frequency, ...] to keep the
+    serialized form small.
+    """
+
+    def __init__(self, postings: Dict[str, List[int]], doc_lengths: List[int], k1: float = 1.5, b: float = 0.75):
+        self.postings = postings
+        self.doc_lengths = doc_lengths
+        self.k1 = k1
+        self.b = b
+        self.avg_length = (sum(doc_lengths) / len(doc_lengths)) if doc_lengths else 0.0
+
+    @classmethod
+    def from_texts(cls, texts: List[str]) -> "BM25Index":
+        postings = {}
+        doc_lengths = []
+        for position, text in enumerate(texts):
+            tokens = tokenize(text)
+            doc_lengths.append(len(tokens))
+            for term, frequency in Counter(tokens).items():
+                postings.setdefault(term, []).extend((position, frequency))
+        return cls(postings, doc_lengths)
+
+    @classmethod
+    def from_knowledge_base(cls, knowledge_base) -> "BM25Index":
+        return cls.from_texts([
+            knowledge_base.docstore.search(knowledge_base.index_to_docstore_id[position]).page_content
+            for position in range(len(knowledge_base.index_to_docstore_id))
+        ])
+
+    def to_dict(self) -> dict:
+        return {"k1": self.k1, "b": self.b, "doc_lengths": self.doc_lengths, "postings": self.postings}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "BM25Index":
+        return cls(data["postings"], data["doc_lengths"], k1=data["k1"], b=data["b"])
+
+    def search(self, query: str, k: int) -> List[Tuple[int, float]]:
+        """Return up to k (position, score) pairs, best first."""
+        total = len(self.doc_lengths)
+        if not total:
+            return []
+
+        avg_length = self.avg_length or 1.0
+        scores = {}
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            document_frequency = len(postings) // 2
+            idf = math.log(1 + (total - document_frequency + 0.5) / (document_frequency + 0.5))
+            for i in range(0, len(postings), 2):
+                position, frequency = postings[i], postings[i + 1]
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[position] / avg_length)
+                scores[position] = scores.get(position, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + norm)
+
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
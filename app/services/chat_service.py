@@ -0,0 +1,122 @@
+import inspect
+
+from langchain_core.prompts import PromptTemplate, format_document
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import settings
+from app.models.chat_history_model import ChatHistory
+from app.models.chat_message_model import ChatMessage
+from app.services.token_service import pack_context, count_tokens
+
+PROMPT_TEMPLATE = PromptTemplate(
+    input_variables=["context", "question"],
+    # cleandoc strips the source indentation, which would otherwise be sent as tokens on every call
+    template=inspect.cleandoc("""You are an intelligent assistant helping a user understand information from their PDF document.
+
+            Instructions:
+            - Carefully analyze the provided context from the PDF document.
+            - Answer the user's question based ONLY on the information provided in the context.
+            - If the answer is fully contained in the context, provide a clear, concise response.
+            - If the answer is partially in the context, provide what you can find and indicate what information is missing.
+            - If the answer is not in the context at all, politely state that the information isn't present in the provided sections.
+            - Do not make up information or use knowledge outside of the provided context.
+            - If the context is ambiguous or unclear, acknowledge this and explain what's confusing.
+            - For complex questions, break down your answer into structured parts.
+            - When referencing specific parts of the document, indicate where the information came from (e.g., "According to page 5..." or "In the section about...").
+            - If the user asks for a summary, focus on key points rather than every detail.
+
+            Context from PDF: {context}
+
+            User Question: {question}
+
+            Answer:""")
+)
+
+# Rewrites a follow-up into a question that retrieval and the answer cache can use on its own
+CONDENSE_PROMPT = PromptTemplate(
+    input_variables=["history", "question"],
+    template=inspect.cleandoc("""Given the conversation so far and a follow-up question, rewrite the follow-up as a standalone question that can be understood without the conversation.
+            Keep names, numbers, section references and other exact terms unchanged. If the follow-up already stands on its own, repeat it as it is.
+
+            Conversation:
+            {history}
+
+            Follow-up question: {question}
+
+            Standalone question:""")
+)
+
+# Folds turns that leave the recent window into the conversation's running summary
+SUMMARY_PROMPT = PromptTemplate(
+    input_variables=["summary", "turns", "max_words"],
+    template=inspect.cleandoc("""Progressively summarize a conversation between a user and an assistant about their PDF documents.
+            Extend the current summary with the new turns. Keep the topics, documents, pages and facts the user may refer back to, and drop pleasantries.
+
+            Current summary:
+            {summary}
+
+            New turns:
+            {turns}
+
+            Updated summary in at most {max_words} words:""")
+)
+
+# Label each retrieved chunk with its page so answers can cite it
+DOCUMENT_PROMPT = PromptTemplate(
+    input_variables=["page_content", "page"],
+    template="[Page {page}]\n{page_content}"
+)
+
+
+# Library answers draw on several documents, so chunks also name their source
+LIBRARY_DOCUMENT_PROMPT = PromptTemplate(
+    input_variables=["page_content", "page", "source"],
+    template="[{source}, page {page}]\n{page_content}"
+)
+
+
+def format_context(documents, document_prompt: PromptTemplate = DOCUMENT_PROMPT) -> str:
+    return "\n\n".join(format_document(document, document_prompt) for document in documents)
+
+
+def build_prompt_inputs(question: str, documents, document_prompt: PromptTemplate = DOCUMENT_PROMPT):
+    """Pack retrieved chunks into the context token budget.
+
+    Returns the chain inputs, the chunks that were packed and token stats.
+    """
+    packed, usage = pack_context(documents, document_prompt, settings.CONTEXT_TOKEN_BUDGET)
+    inputs = {"context": format_context(packed, document_prompt), "question": question}
+    usage["prompt_tokens"] = count_tokens(PROMPT_TEMPLATE.format(**inputs))
+    return inputs, packed, usage
+
+
+async def get_or_create_conversation(db: AsyncSession, pdf_id: str) -> ChatHistory:
+    conversation = (await db.execute(
+        select(ChatHistory).where(ChatHistory.pdf_id == pdf_id).limit(1)
+    )).scalar()
+    if not conversation:
+        conversation = ChatHistory(pdf_id=pdf_id)
+        db.add(conversation)
+        await db.commit()
+    return conversation
+
+
+async def get_or_create_library_conversation(db: AsyncSession, user_id: str) -> ChatHistory:
+    # Questions across several documents share one conversation per user
+    conversation = (await db.execute(
+        select(ChatHistory).where(ChatHistory.user_id == user_id, ChatHistory.pdf_id.is_(None)).limit(1)
+    )).scalar()
+    if not conversation:
+        conversation = ChatHistory(user_id=user_id)
+        db.add(conversation)
+        await db.commit()
+    return conversation
+
+
+async def save_message(db: AsyncSession, conversation_id: str, question: str, answer: str) -> ChatMessage:
+    # Append the new question and answer as a single row, never rewriting earlier turns
+    message = ChatMessage(conversation_id=conversation_id, question=question, answer=answer)
+    db.add(message)
+    await db.commit()
+    return message
@@ -0,0 +1,155 @@
+import os
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import List, Optional
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from tenacity import retry, stop_after_attempt, wait_exponential
+from langchain_core.embeddings import Embeddings
+
+from app.config import settings
+from app.services.upstream_scheduler import upstream_scheduler, bulk_user
+
+
+class EmbeddingCache:
+    """Persistent content-hash -> vector cache in a local SQLite file."""
+
+    def __init__(self, path: str):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+        )
+        self._conn.commit()
+        self._lock = threading.Lock()
+
+    def get_many(self, keys: List[str]) -> dict:
+        found = {}
+        with self._lock:
+            # Stay well under SQLite's bound-parameter limit
+            for i in range(0, len(keys), 500):
+                batch = keys[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})",
+                    batch
+                ).fetchall()
+                for key, vector in rows:
+                    found[key] = np.frombuffer(vector, dtype=np.float32).tolist()
+        return found
+
+    def put_many(self, items: dict):
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (key, vector) VALUES (?, ?)",
+                [(key, np.asarray(vector, dtype=np.float32).tobytes()) for key, vector in items.items()]
+            )
+            self._conn.commit()
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that only sends texts missing from the cache upstream.
+
+    Misses are de-duplicated, grouped into batches of batch_size and embedded
+    with at most `concurrency` batches in flight, each retried with backoff.
+    Questions rarely repeat, so they skip the persistent cache for a small
+    per-worker LRU of `query_cache_size` entries.
+    """
+
+    def __init__(self, provider: Embeddings, model_name: str, cache: EmbeddingCache,
+                 batch_size: int, concurrency: int, query_cache_size: int):
+        self.provider = provider
+        self.model_name = model_name
+        self.cache = cache
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.query_cache_size = query_cache_size
+        self._queries = OrderedDict()  # cache key -> vector
+        self._queries_lock = threading.Lock()
+
+    def cache_key(self, text: str) -> str:
+        # Vectors from different models are not interchangeable
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    @retry(
+        stop=stop_after_attempt(settings.EMBEDDING_MAX_RETRIES),
+        wait=wait_exponential(multiplier=0.5, max=20),
+        reraise=True
+    )
+    def _embed_batch(self, texts: List[str], owner: Optional[str] = None) -> List[List[float]]:
+        if owner is None:
+            return self.provider.embed_documents(texts)
+        # Ingestion queues each attempt behind interactive questions, and backs off without holding a slot
+        return upstream_scheduler.call_threadsafe(self.provider.embed_documents, texts, user=owner)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self.cache_key(text) for text in texts]
+        vectors = self.cache.get_many(list(set(keys)))
+
+        misses = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors:
+                misses[key] = text
+
+        if misses:
+            # Read on the calling thread; the batch threads below do not inherit it
+            owner = bulk_user()
+            miss_keys = list(misses)
+            batches = [miss_keys[i:i + self.batch_size] for i in range(0, len(miss_keys), self.batch_size)]
+            with ThreadPoolExecutor(max_workers=max(1, min(self.concurrency, len(batches)))) as pool:
+                results = pool.map(lambda batch: self._embed_batch([misses[key] for key in batch], owner), batches)
+                for batch, embedded in zip(batches, results):
+                    new_vectors = dict(zip(batch, embedded))
+                    self.cache.put_many(new_vectors)
+                    vectors.update(new_vectors)
+
+        return [vectors[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        key = self.cache_key(text)
+        with self._queries_lock:
+            vector = self._queries.get(key)
+            if vector is not None:
+                self._queries.move_to_end(key)
+                return vector
+
+        vector = self._embed_batch([text])[0]
+        with self._queries_lock:
+            self._queries[key] = vector
+            while len(self._queries) > self.query_cache_size:
+                self._queries.popitem(last=False)
+        return vector
+
+
+def create_embedding_provider():
+    from langchain_community.embeddings import OpenAIEmbeddings, DeterministicFakeEmbedding
+    if settings.EMBEDDING_PROVIDER == "fake":
+        # Deterministic, offline stand-in for tests and benchmarks
+        return DeterministicFakeEmbedding(size=settings.FAKE_EMBEDDING_SIZE), f"fake-{settings.FAKE_EMBEDDING_SIZE}"
+    if settings.EMBEDDING_PROVIDER == "openai":
+        return OpenAIEmbeddings(model=settings.EMBEDDING_MODEL), settings.EMBEDDING_MODEL
+    raise ValueError(f"Unknown EMBEDDING_PROVIDER: {settings.EMBEDDING_PROVIDER}")
+
+
+_embeddings = None
+_embeddings_lock = threading.Lock()
+
+
+def get_embeddings() -> CachedEmbeddings:
+    global _embeddings
+    with _embeddings_lock:
+        if _embeddings is None:
+            provider, model_name = create_embedding_provider()
+            _embeddings = CachedEmbeddings(
+                provider=provider,
+                model_name=model_name,
+                cache=EmbeddingCache(settings.EMBEDDING_CACHE_PATH),
+                batch_size=settings.EMBEDDING_BATCH_SIZE,
+                concurrency=settings.EMBEDDING_CONCURRENCY,
+                query_cache_size=settings.QUERY_EMBEDDING_CACHE_SIZE
+            )
+        return _embeddings
@@ -0,0 +1,24 @@
+import asyncio
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+
+from app.config import settings
+
+# Bounded pool for CPU-heavy or blocking work on the request path (index loads,
+# FAISS search, query embedding), so it never runs on the event loop and never
+# spawns an unbounded number of threads under load
+cpu_executor = ThreadPoolExecutor(max_workers=settings.CPU_EXECUTOR_WORKERS, thread_name_prefix="cpu")
+
+# Password hashing gets its own pool: bcrypt releases the GIL, so hashes run in
+# parallel, and a login storm queues here instead of starving searches and index loads
+password_executor = ThreadPoolExecutor(max_workers=settings.PASSWORD_HASH_WORKERS, thread_name_prefix="password")
+
+
+async def run_blocking(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(cpu_executor, partial(func, *args, **kwargs))
+
+
+async def run_password_hash(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(password_executor, partial(func, *args, **kwargs))
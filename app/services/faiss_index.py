@@ -0,0 +1,119 @@
+import math
+import time
+from typing import Tuple
+
+import numpy as np
+
+from app.config import settings
+
+NPROBE_CANDIDATES = [1, 2, 4, 8, 16, 32, 64, 128, 256]
+EF_SEARCH_CANDIDATES = [16, 32, 64, 128, 256, 512]
+# 8-bit product quantizer codebooks need this many points per sub-quantizer to train
+PQ_MIN_TRAINING_POINTS = 256 * 39
+
+
+def choose_index_factory(count: int, dimension: int) -> str:
+    """Pick a FAISS index_factory string for a knowledge base of `count` vectors.
+
+    Small documents keep an exact flat index. Larger ones get an IVF or HNSW
+    index (FAISS_INDEX_TYPE) with optional SQ8, float16 or PQ compression
+    (FAISS_COMPRESSION).
+    """
+    if count < settings.FAISS_FLAT_MAX_CHUNKS:
+        return "Flat"
+
+    codec = {"none": "Flat", "sq8": "SQ8", "fp16": "SQfp16"}.get(settings.FAISS_COMPRESSION)
+    if settings.FAISS_COMPRESSION == "pq":
+        if count >= PQ_MIN_TRAINING_POINTS:
+            # Largest sub-quantizer count up to 64 that divides the dimension
+            codec = f"PQ{max(m for m in range(1, 65) if dimension % m == 0)}"
+        else:
+            codec = "SQ8"
+    if codec is None:
+        raise ValueError(f"Unknown FAISS_COMPRESSION: {settings.FAISS_COMPRESSION}")
+
+    if settings.FAISS_INDEX_TYPE == "ivf":
+        # About 4 * sqrt(n) lists, with enough points per list to train the centroids
+        nlist = max(1, min(int(4 * math.sqrt(count)), count // 39))
+        return f"IVF{nlist},{codec}"
+    if settings.FAISS_INDEX_TYPE == "hnsw":
+        return f"HNSW32_{codec}" if codec.startswith("PQ") else f"HNSW32,{codec}"
+    raise ValueError(f"Unknown FAISS_INDEX_TYPE: {settings.FAISS_INDEX_TYPE}")
+
+
+def search_parameter(index) -> Tuple[str, list]:
+    import faiss
+    # The knob that trades recall for speed on this index type, if it has one
+    if isinstance(index, faiss.IndexIVF):
+        return "nprobe", [n for n in NPROBE_CANDIDATES if n <= index.nlist] or [index.nlist]
+    if isinstance(index, faiss.IndexHNSW):
+        return "efSearch", EF_SEARCH_CANDIDATES
+    return None, []
+
+
+def apply_search_parameters(index, manifest: dict):
+    import faiss
+    name = manifest.get("search_parameter")
+    if name:
+        faiss.ParameterSpace().set_index_parameter(index, name, manifest["search_value"])
+
+
+def _timed_search(index, queries: np.ndarray, k: int):
+    start = time.perf_counter()
+    _, ids = index.search(queries, k)
+    return ids, (time.perf_counter() - start) * 1000 / len(queries)
+
+
+def build_index(vectors: np.ndarray):
+    """Build, tune and measure an index for `vectors`, returning it with its manifest."""
+    import faiss
+    count, dimension = vectors.shape
+    factory = choose_index_factory(count, dimension)
+    index = faiss.index_factory(dimension, factory)
+    if not index.is_trained:
+        index.train(vectors)
+    index.add(vectors)
+    return index, {"index_factory": factory, **tune_index(index, vectors)}
+
+
+def tune_index(index, vectors: np.ndarray) -> dict:
+    """Tune and measure `index`, which holds exactly `vectors`, returning its manifest fields.
+
+    Recall@k is measured against exact search on synthetic queries halfway
+    between random pairs of stored vectors. For IVF and HNSW the smallest
+    nprobe / efSearch reaching FAISS_TARGET_RECALL is chosen.
+    """
+    import faiss
+    count, dimension = vectors.shape
+    k = min(settings.FAISS_RECALL_K, count)
+    rng = np.random.default_rng(0)
+    pairs = rng.integers(0, count, size=(min(settings.FAISS_RECALL_QUERIES, count), 2))
+    queries = np.ascontiguousarray((vectors[pairs[:, 0]] + vectors[pairs[:, 1]]) / 2, dtype=np.float32)
+
+    exact = faiss.IndexFlatL2(dimension)
+    exact.add(vectors)
+    exact_ids, exact_ms = _timed_search(exact, queries, k)
+
+    name, candidates = search_parameter(index)
+    parameter_space = faiss.ParameterSpace()
+    for value in candidates or [None]:
+        if name:
+            parameter_space.set_index_parameter(index, name, value)
+        ids, query_ms = _timed_search(index, queries, k)
+        recall = float(np.mean([
+            len(set(found) & set(expected)) / k for found, expected in zip(ids, exact_ids)
+        ]))
+        if recall >= settings.FAISS_TARGET_RECALL:
+            break
+
+    return {
+        "chunks": count,
+        "dimension": dimension,
+        "index_bytes": int(faiss.serialize_index(index).nbytes),
+        "search_parameter": name,
+        "search_value": value,
+        "recall_k": k,
+        "recall": round(recall, 4),
+        "query_ms": round(query_ms, 4),
+        "exact_query_ms": round(exact_ms, 4),
+    }
@@ -0,0 +1,46 @@
+import time
+import asyncio
+from typing import Any, Iterator, AsyncIterator, List, Optional
+
+from langchain_core.language_models.llms import LLM
+from langchain_core.outputs import GenerationChunk
+
+
+class FakeStreamingLLM(LLM):
+    """Offline LLM for tests and benchmarks.
+
+    Answers with a fixed response after `latency` seconds, streaming it word by
+    word with `token_delay` seconds between words.
+    """
+
+    response: str = "This is a fake answer generated from the provided context."
+    latency: float = 0.0
+    token_delay: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-streaming"
+
+    def _tokens(self) -> List[str]:
+        words = self.response.split(" ")
+        return [word if i == 0 else " " + word for i, word in enumerate(words)]
+
+    def _call(self, prompt: str, stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> str:
+        time.sleep(self.latency + self.token_delay * len(self._tokens()))
+        return self.response
+
+    async def _acall(self, prompt: str, stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> str:
+        await asyncio.sleep(self.latency + self.token_delay * len(self._tokens()))
+        return self.response
+
+    def _stream(self, prompt: str, stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> Iterator[GenerationChunk]:
+        time.sleep(self.latency)
+        for token in self._tokens():
+            time.sleep(self.token_delay)
+            yield GenerationChunk(text=token)
+
+    async def _astream(self, prompt: str, stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> AsyncIterator[GenerationChunk]:
+        await asyncio.sleep(self.latency)
+        for token in self._tokens():
+            await asyncio.sleep(self.token_delay)
+            yield GenerationChunk(text=token)
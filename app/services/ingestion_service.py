@@ -0,0 +1,382 @@
+import os
+import math
+import time
+import socket
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import func
+
+from app.config import settings
+from app.db import SessionLocal
+from app.models.pdf_model import PDF, PDFStatus
+from app.services.vector_store import build_knowledge_base, save_knowledge_base, patch_knowledge_base
+from app.services.pdf_extraction import iter_pages
+from app.services.token_service import create_text_splitter
+from app.services.upload_service import discard_upload
+from app.services.knowledge_base_service import (
+    find_duplicate_index, acquire_knowledge_base, release_knowledge_base, commit_releases
+)
+from app.services.kb_cache import kb_cache
+from app.services.library_index import sync_library
+from app.services.answer_cache import answer_cache
+from app.services.metrics_service import timed, observe_stage, record_error, INGESTED_CHUNKS, INGESTION_JOBS
+from app.services.upstream_scheduler import bulk_work
+
+
+class IngestionQueueFull(Exception):
+    def __init__(self, retry_after: int):
+        super().__init__(f"Ingestion queue is full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class KnowledgeBaseGone(Exception):
+    """The stored index a job meant to share was freed by a delete before it took a reference."""
+
+
+executor = ThreadPoolExecutor(max_workers=settings.INGEST_WORKERS, thread_name_prefix="ingest")
+# Running plus waiting jobs; uploads are refused instead of queueing without bound
+_slots = threading.BoundedSemaphore(settings.INGEST_WORKERS + settings.INGEST_QUEUE_SIZE)
+# Moving average of job duration, for Retry-After when the queue is full
+_job_seconds = 30.0
+
+
+def retry_after() -> int:
+    # A slot frees up each time one of the workers finishes a job
+    return max(1, math.ceil(_job_seconds / settings.INGEST_WORKERS))
+
+
+def _run_job(job, pdf_id: str, pdf_path: str, *args):
+    global _job_seconds
+    # The job owns the spooled upload from submission on
+    start = time.perf_counter()
+    try:
+        job(pdf_id, pdf_path, *args)
+    finally:
+        discard_upload(pdf_path)
+        _job_seconds = 0.8 * _job_seconds + 0.2 * (time.perf_counter() - start)
+
+
+def _submit(job, pdf_id: str, pdf_path: str, *args):
+    if not _slots.acquire(blocking=False):
+        raise IngestionQueueFull(retry_after())
+    future = executor.submit(_run_job, job, pdf_id, pdf_path, *args)
+    future.add_done_callback(lambda _: _slots.release())
+    return future
+
+
+def job_owner() -> str:
+    # Looked up on each call, since preloading servers fork workers after import
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def job_claim(pdf_path: str) -> dict:
+    """PDF column values recording that this process runs the PDF's job from `pdf_path`.
+
+    Set together with the queued or updating status, before the job is submitted.
+    """
+    return {
+        "job_owner": job_owner(),
+        "job_heartbeat": datetime.datetime.utcnow(),
+        "spool_path": pdf_path,
+    }
+
+
+def _stale_jobs(cutoff: datetime.datetime):
+    # Rows claimed before jobs had heartbeats fall back to their upload time
+    return (
+        PDF.status.in_(PDFStatus.IN_PROGRESS),
+        func.coalesce(PDF.job_heartbeat, PDF.uploaded_date) < cutoff,
+    )
+
+
+def recover_interrupted_jobs(db) -> dict:
+    """Settle jobs whose process has stopped marking them alive.
+
+    Jobs only live in their process's thread pool, so a crashed or restarted
+    worker drops them. Once a job's heartbeat is older than
+    INGEST_STALE_SECONDS, an unfinished upload is marked failed and an
+    unfinished revision goes back to ready on its previous, intact revision.
+    Only those jobs' spooled uploads are removed. Jobs of live processes are
+    never touched, so any worker, or the migration, may run this at any time.
+    """
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=settings.INGEST_STALE_SECONDS)
+    rows = db.query(PDF.id, PDF.status, PDF.spool_path).filter(*_stale_jobs(cutoff)).all()
+    settled = {"ingest": 0, "revision": 0}
+    for row in rows:
+        if row.status == PDFStatus.UPDATING:
+            job, values = "revision", {"status": PDFStatus.READY, "error": "Revision was interrupted, please upload it again"}
+        else:
+            job, values = "ingest", {"status": PDFStatus.FAILED, "error": "Ingestion was interrupted, please upload the PDF again"}
+        # Still stale and in the same state, so two workers never both settle one job
+        updated = db.query(PDF).filter(PDF.id == row.id, PDF.status == row.status, *_stale_jobs(cutoff)).update(
+            values, synchronize_session=False
+        )
+        db.commit()
+        if updated:
+            settled[job] += 1
+            INGESTION_JOBS.labels(job, "interrupted").inc()
+            if row.spool_path:
+                discard_upload(row.spool_path)
+    return settled
+
+
+_heartbeat_stop = None
+
+
+def _heartbeat_loop(stop: threading.Event):
+    while not stop.wait(settings.INGEST_HEARTBEAT_SECONDS):
+        db = SessionLocal()
+        try:
+            db.query(PDF).filter(
+                PDF.job_owner == job_owner(),
+                PDF.status.in_(PDFStatus.IN_PROGRESS)
+            ).update({"job_heartbeat": datetime.datetime.utcnow()}, synchronize_session=False)
+            db.commit()
+            recover_interrupted_jobs(db)
+        except Exception as error:
+            db.rollback()
+            record_error("heartbeat", error, owner=job_owner())
+        finally:
+            db.close()
+
+
+def start_job_heartbeat():
+    """Keep this process's jobs marked alive, and settle those of processes that stopped."""
+    global _heartbeat_stop
+    _heartbeat_stop = threading.Event()
+    threading.Thread(target=_heartbeat_loop, args=(_heartbeat_stop,), name="ingest-heartbeat", daemon=True).start()
+
+
+def stop_job_heartbeat():
+    if _heartbeat_stop is not None:
+        _heartbeat_stop.set()
+
+
+def submit_ingestion(pdf_id: str, pdf_path: str):
+    return _submit(ingest_pdf, pdf_id, pdf_path)
+
+
+def submit_revision(pdf_id: str, pdf_path: str, size: int, fingerprint: str):
+    return _submit(revise_pdf, pdf_id, pdf_path, size, fingerprint)
+
+
+def _sync_library(db, user_id: str, pdf_id: str):
+    # The library only makes questions fast; one that missed an update still searches
+    # the document in its own index, so a failure here never fails the job
+    try:
+        with bulk_work(user_id):
+            sync_library(db, user_id, pdf_id)
+    except Exception as error:
+        db.rollback()
+        record_error("library", error, pdf_id=pdf_id)
+
+
+def _run_library_sync(user_id: str, pdf_id: str):
+    db = SessionLocal()
+    try:
+        _sync_library(db, user_id, pdf_id)
+    finally:
+        db.close()
+
+
+def submit_library_sync(user_id: str, pdf_id: str):
+    """Update the user's library for a PDF that became ready or was deleted outside a job."""
+    return executor.submit(_run_library_sync, user_id, pdf_id)
+
+
+def _update_pdf(db, pdf_id: str, **values) -> bool:
+    # Returns False when the PDF was deleted while its job was running
+    updated = db.query(PDF).filter(PDF.id == pdf_id).update(values, synchronize_session=False)
+    db.commit()
+    return updated > 0
+
+
+def _take_reference(db, pdf_id: str, index_key: str, values: dict) -> bool:
+    """Point a PDF at index_key, committing the PDF row and its reference on the index together.
+
+    Returns False when the PDF was deleted while its job was running; the
+    reference is dropped again, freeing the index if nothing else uses it.
+    Raises KnowledgeBaseGone when the index was freed before the reference was taken.
+    """
+    if not acquire_knowledge_base(db, index_key):
+        db.rollback()
+        raise KnowledgeBaseGone(index_key)
+    updated = db.query(PDF).filter(PDF.id == pdf_id).update(
+        {"index_key": index_key, **values}, synchronize_session=False
+    )
+    if not updated:
+        freed = release_knowledge_base(db, index_key)
+        commit_releases(db, [index_key] if freed else [])
+        return False
+    return True
+
+
+def _mark_ready(db, pdf_id: str, index_key: str) -> bool:
+    # A PDF uploaded before the vector store existed no longer needs its stored bytes
+    if not _take_reference(db, pdf_id, index_key, {"status": PDFStatus.READY, "content": None}):
+        return False
+    db.commit()
+    return True
+
+
+def _save_and_apply(apply, knowledge_base, manifest: dict, vectors, flow: str):
+    """Save a built knowledge base and apply(index_key) it to the PDF, returning both results."""
+    with timed(flow, "serialize"):
+        index_key = save_knowledge_base(knowledge_base, manifest, vectors)
+    with timed(flow, "db_write"):
+        try:
+            return index_key, apply(index_key)
+        except KnowledgeBaseGone:
+            # The save found an identical index already stored, and a delete freed it
+            # before the reference was taken: store it again
+            index_key = save_knowledge_base(knowledge_base, manifest, vectors)
+            return index_key, apply(index_key)
+
+
+def split_pdf(pdf_path: str, flow: str = "upload"):
+    # Chunks are sized in LLM tokens and split at section, paragraph and sentence boundaries
+    text_splitter = create_text_splitter()
+
+    # Split page by page as pages are extracted, so the whole document text is
+    # never held at once and every chunk knows which page it came from
+    chunks = []
+    extract_seconds = split_seconds = 0.0
+    pages = iter_pages(pdf_path)
+    while True:
+        start = time.perf_counter()
+        page = next(pages, None)
+        extract_seconds += time.perf_counter() - start
+        if page is None:
+            break
+        page_number, text = page
+        if text.strip():
+            start = time.perf_counter()
+            chunks.extend(text_splitter.create_documents([text], metadatas=[{"page": page_number}]))
+            split_seconds += time.perf_counter() - start
+    # Extraction and splitting interleave, so each stage is reported once as its total
+    observe_stage(flow, "extract", extract_seconds)
+    observe_stage(flow, "split", split_seconds)
+    if not chunks:
+        raise ValueError('No extractable text found in the PDF')
+    return chunks
+
+
+def ingest_pdf(pdf_id: str, pdf_path: str):
+    db = SessionLocal()
+    try:
+        if not _update_pdf(db, pdf_id, status=PDFStatus.PARSING):
+            return
+
+        # An identical upload may have finished while this one was queued
+        pdf = db.query(PDF.user_id, PDF.fingerprint).filter(PDF.id == pdf_id).first()
+        if pdf is None:
+            return
+        duplicate_index_key = find_duplicate_index(db, pdf.fingerprint) if pdf.fingerprint else None
+        if duplicate_index_key:
+            try:
+                if _mark_ready(db, pdf_id, duplicate_index_key):
+                    _sync_library(db, pdf.user_id, pdf_id)
+                INGESTION_JOBS.labels("ingest", "duplicate").inc()
+                return
+            except KnowledgeBaseGone:
+                # Its last owner was deleted meanwhile, so it is built like any new upload
+                pass
+
+        chunks = split_pdf(pdf_path)
+
+        if not _update_pdf(db, pdf_id, status=PDFStatus.EMBEDDING):
+            return
+
+        # Embed the chunks, only paying for ones the embedding cache has not seen, and build the knowledge base
+        # with an index sized to the document, recording its measured recall and latency.
+        # Its embedding calls queue behind interactive questions
+        with bulk_work(pdf.user_id):
+            knowledge_base, manifest, vectors = build_knowledge_base(chunks)
+        _, ready = _save_and_apply(
+            lambda index_key: _mark_ready(db, pdf_id, index_key), knowledge_base, manifest, vectors, "upload"
+        )
+        if not ready:
+            return
+        with timed("upload", "library"):
+            _sync_library(db, pdf.user_id, pdf_id)
+        INGESTED_CHUNKS.labels("embedded").inc(len(chunks))
+        INGESTION_JOBS.labels("ingest", "ready").inc()
+
+    except Exception as error:
+        db.rollback()
+        INGESTION_JOBS.labels("ingest", "failed").inc()
+        record_error("upload", error, pdf_id=pdf_id)
+        _update_pdf(db, pdf_id, status=PDFStatus.FAILED, error=str(error))
+    finally:
+        db.close()
+
+
+def _swap_index(db, pdf_id: str, old_index_key: str, new_index_key: str, **values) -> bool:
+    """Point a revised PDF at its new knowledge base and drop its reference on the old one.
+
+    Everything is committed together; the old index files are removed once no
+    PDF uses them any more. Returns False, and raises KnowledgeBaseGone, as
+    _take_reference does.
+    """
+    values = {"status": PDFStatus.READY, "error": None, **values}
+    if not _take_reference(db, pdf_id, new_index_key, values):
+        return False
+    # An unchanged index is acquired and released once each, leaving its count as it was
+    freed = release_knowledge_base(db, old_index_key)
+    commit_releases(db, [old_index_key] if freed else [])
+
+    if freed:
+        kb_cache.invalidate(old_index_key)
+        answer_cache.invalidate(old_index_key)
+    return True
+
+
+def revise_pdf(pdf_id: str, pdf_path: str, size: int, fingerprint: str):
+    """Apply a new revision of a ready PDF, re-embedding only the chunks that changed.
+
+    The PDF keeps answering from its previous revision until the new knowledge
+    base is swapped in, and its conversation is untouched.
+    """
+    db = SessionLocal()
+    try:
+        pdf = db.query(PDF.user_id, PDF.index_key, PDF.fingerprint).filter(PDF.id == pdf_id).first()
+        if pdf is None:
+            return
+        values = {"size": size, "fingerprint": fingerprint}
+
+        def swap(index_key: str) -> bool:
+            return _swap_index(db, pdf_id, pdf.index_key, index_key, **values)
+
+        # Identical bytes may already have a knowledge base somewhere
+        swapped = None
+        duplicate_index_key = find_duplicate_index(db, values["fingerprint"])
+        if duplicate_index_key:
+            try:
+                with timed("revision", "db_write"):
+                    swapped = swap(duplicate_index_key)
+            except KnowledgeBaseGone:
+                pass
+        if swapped is None:
+            chunks = split_pdf(pdf_path, "revision")
+            with bulk_work(pdf.user_id):
+                knowledge_base, manifest, vectors, stats = patch_knowledge_base(pdf.index_key, chunks)
+            _, swapped = _save_and_apply(swap, knowledge_base, manifest, vectors, "revision")
+            INGESTED_CHUNKS.labels("reused").inc(stats["reused_chunks"])
+            INGESTED_CHUNKS.labels("embedded").inc(stats["embedded_chunks"])
+            INGESTED_CHUNKS.labels("removed").inc(stats["removed_chunks"])
+        if not swapped:
+            return
+        with timed("revision", "library"):
+            _sync_library(db, pdf.user_id, pdf_id)
+        INGESTION_JOBS.labels("revision", "ready").inc()
+
+    except Exception as error:
+        db.rollback()
+        INGESTION_JOBS.labels("revision", "failed").inc()
+        record_error("revision", error, pdf_id=pdf_id)
+        # The previous revision is still intact, so the PDF stays usable
+        _update_pdf(db, pdf_id, status=PDFStatus.READY, error=f"Revision failed: {str(error)}")
+    finally:
+        db.close()
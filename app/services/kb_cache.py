@@ -0,0 +1,135 @@
+import pickle
+import threading
+from collections import OrderedDict
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import settings
+from app.models.pdf_model import PDF
+from app.services.vector_store import load_knowledge_base, load_bm25_index, ensure_page_metadata
+from app.services.bm25_index import BM25Index
+from app.services.retrieval_service import HybridRetriever
+from app.services.executor_service import run_blocking
+
+
+class KnowledgeBaseCache:
+    """Per-worker LRU cache of opened knowledge bases, keyed by index_key.
+
+    Eviction happens when either the entry count or the summed serialized
+    size of the cached knowledge bases goes over its limit.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # cache key -> (knowledge_base, size in bytes)
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: str, knowledge_base, size: int):
+        # Knowledge bases that can never fit are not worth evicting everything else for
+        if size > self.max_bytes or self.max_entries <= 0:
+            return
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (knowledge_base, size)
+            self._total_bytes += size
+            while len(self._entries) > self.max_entries or self._total_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._total_bytes -= evicted_size
+                self.evictions += 1
+
+    def invalidate(self, key: str):
+        with self._lock:
+            self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._total_bytes -= entry[1]
+
+
+kb_cache = KnowledgeBaseCache(
+    max_entries=settings.KB_CACHE_MAX_ENTRIES,
+    max_bytes=settings.KB_CACHE_MAX_BYTES
+)
+
+
+def kb_cache_key(pdf_record) -> str:
+    # A stored index never changes under its key, so a revision, which moves the row
+    # to a new index_key, is a miss in every worker; legacy rows fall back to their id
+    return pdf_record.index_key or f"pdf:{pdf_record.id}"
+
+
+def open_knowledge_base(index_key: str):
+    knowledge_base, size = load_knowledge_base(index_key)
+    bm25, bm25_size = load_bm25_index(index_key, knowledge_base)
+    return HybridRetriever(knowledge_base, bm25), size + bm25_size
+
+
+def cached_knowledge_base(index_key: str):
+    # For callers already off the event loop, such as library searches resolving their hits
+    knowledge_base = kb_cache.get(index_key)
+    if knowledge_base is None:
+        knowledge_base, size = open_knowledge_base(index_key)
+        kb_cache.put(index_key, knowledge_base, size)
+    return knowledge_base
+
+
+def load_legacy_knowledge_base(content: bytes):
+    # Rows uploaded before the vector store existed still carry a pickled blob
+    knowledge_base = pickle.loads(content)
+    ensure_page_metadata(knowledge_base)
+    return HybridRetriever(knowledge_base, BM25Index.from_knowledge_base(knowledge_base)), len(content)
+
+
+async def get_knowledge_base(pdf_record: PDF, db: AsyncSession):
+    # Takes the row the ownership check already loaded, so a cache miss does not query it again
+    pdf_id = pdf_record.id
+    cache_key = kb_cache_key(pdf_record)
+    knowledge_base = kb_cache.get(cache_key)
+    if knowledge_base is not None:
+        return knowledge_base
+
+    # Opening or unpickling an index is blocking work, kept off the event loop
+    if pdf_record.index_key:
+        knowledge_base, size = await run_blocking(open_knowledge_base, pdf_record.index_key)
+    else:
+        content = (await db.execute(select(PDF.content).where(PDF.id == pdf_id))).scalar()
+        if content is None:
+            return None
+        knowledge_base, size = await run_blocking(load_legacy_knowledge_base, content)
+
+    kb_cache.put(cache_key, knowledge_base, size)
+    return knowledge_base
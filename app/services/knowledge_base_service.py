@@ -0,0 +1,79 @@
+from typing import List, Optional
+
+from sqlalchemy.orm import Session
+
+from app.models.pdf_model import PDF, PDFStatus
+from app.models.knowledge_base_model import KnowledgeBase
+from app.services.vector_store import index_exists, retire_knowledge_base, restore_knowledge_base, delete_retired
+
+
+def find_duplicate_index(db: Session, fingerprint: str) -> Optional[str]:
+    # Any ready PDF with identical bytes already has a usable knowledge base
+    row = db.query(PDF.index_key).filter(
+        PDF.fingerprint == fingerprint,
+        PDF.status.in_(PDFStatus.SEARCHABLE),
+        PDF.index_key.isnot(None)
+    ).first()
+    if row is None or not index_exists(row.index_key):
+        return None
+    return row.index_key
+
+
+def acquire_knowledge_base(db: Session, index_key: str) -> bool:
+    """Take a reference on the stored index at index_key, for a PDF row committed with it.
+
+    The row is locked before the files are checked: a release that frees the
+    index moves its files away while holding that lock, so this either sees
+    them gone or keeps them alive. Returns False when they are gone, and the
+    caller builds the knowledge base again instead of pointing a PDF at them.
+    """
+    knowledge_base = db.query(KnowledgeBase).filter(
+        KnowledgeBase.index_key == index_key
+    ).with_for_update().first()
+    if not index_exists(index_key):
+        return False
+    if knowledge_base is None:
+        # A newly stored index, or one stored before reference counting
+        db.add(KnowledgeBase(index_key=index_key, ref_count=1))
+    else:
+        knowledge_base.ref_count += 1
+    db.flush()
+    return True
+
+
+def release_knowledge_base(db: Session, index_key: str) -> bool:
+    """Drop one reference to index_key and return True when it was the last one.
+
+    The caller then passes the freed keys to commit_releases.
+    """
+    knowledge_base = db.query(KnowledgeBase).filter(
+        KnowledgeBase.index_key == index_key
+    ).with_for_update().first()
+    if knowledge_base is None:
+        # Indexes stored before reference counting: free once no row points at them
+        return not db.query(PDF.id).filter(PDF.index_key == index_key).first()
+
+    knowledge_base.ref_count -= 1
+    if knowledge_base.ref_count > 0:
+        return False
+    db.delete(knowledge_base)
+    return True
+
+
+def commit_releases(db: Session, freed: List[str]):
+    """Commit, deleting the stored indexes in `freed` that this transaction released for the last time.
+
+    Their files are moved aside while the rows are still locked and deleted
+    for good only once the commit succeeds; if it fails they are put back.
+    """
+    retired = [(index_key, retire_knowledge_base(index_key)) for index_key in freed]
+    try:
+        db.commit()
+    except Exception:
+        for index_key, path in retired:
+            if path:
+                restore_knowledge_base(index_key, path)
+        raise
+    for _, path in retired:
+        if path:
+            delete_retired(path)
@@ -0,0 +1,220 @@
+import os
+import json
+import fcntl
+from bisect import bisect_right
+from contextlib import contextmanager
+from typing import Dict, List, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.models.pdf_model import PDF, PDFStatus
+from app.services.kb_cache import cached_knowledge_base
+from app.services.faiss_index import apply_search_parameters
+from app.services.vector_store import load_vectors, read_stored_index, load_manifest
+
+# A user's library is an append-only float32 vectors file and a log of which
+# rows belong to which document; the documents' own stored indexes are its
+# shards, and chunk text and pages stay in their docstores
+LOG_FILE = "log.jsonl"
+LOCK_FILE = "lock"
+# Attempts at reading the library while it is being compacted underneath
+READ_ATTEMPTS = 3
+
+
+def library_dir(user_id: str) -> str:
+    return os.path.join(settings.VECTOR_STORE_DIR, "libraries", user_id)
+
+
+def vectors_file(generation: int) -> str:
+    return f"vectors-{generation}.f32"
+
+
+def read_library(user_id: str) -> dict:
+    """Replay a user's library log.
+
+    Returns the vectors file generation and dimension, `pdfs` mapping pdf_id ->
+    (index_key, first row, row count) and `rows`, the rows of the vectors
+    file the log accounts for, including those of removed documents.
+    """
+    state = {"generation": None, "dim": None, "pdfs": {}, "rows": 0}
+    try:
+        with open(os.path.join(library_dir(user_id), LOG_FILE)) as f:
+            for line in f:
+                # A line without its newline is an append still being written
+                if not line.endswith("\n"):
+                    break
+                record = json.loads(line)
+                if "generation" in record:
+                    state["generation"], state["dim"] = record["generation"], record["dim"]
+                elif record["op"] == "add":
+                    state["pdfs"][record["pdf_id"]] = (record["index_key"], record["start"], record["count"])
+                    state["rows"] = max(state["rows"], record["start"] + record["count"])
+                else:
+                    state["pdfs"].pop(record["pdf_id"], None)
+    except FileNotFoundError:
+        pass
+    return state
+
+
+def _append_log(user_id: str, records: List[dict]):
+    with open(os.path.join(library_dir(user_id), LOG_FILE), "a") as f:
+        f.write("".join(json.dumps(record) + "\n" for record in records))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+@contextmanager
+def _locked(user_id: str):
+    # Serializes writers across workers and processes; readers never take it
+    os.makedirs(library_dir(user_id), exist_ok=True)
+    with open(os.path.join(library_dir(user_id), LOCK_FILE), "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        yield
+
+
+def sync_library(db: Session, user_id: str, pdf_id: str):
+    """Bring one document's entry in the user's library in line with its PDF row.
+
+    A ready document's vectors are appended under its current index_key,
+    which also retires the rows of a previous revision; a deleted or failed
+    one is logged as removed. The cost is the size of that document, and the
+    library is compacted once removed rows outnumber live ones. Ingestion
+    jobs and deletes call this in the background.
+    """
+    with _locked(user_id):
+        # Read under the lock, so a delete committed before it was taken is always seen
+        row = db.query(PDF.status, PDF.index_key).filter(PDF.id == pdf_id, PDF.user_id == user_id).first()
+        db.commit()
+        index_key = row.index_key if row is not None and row.status in PDFStatus.SEARCHABLE else None
+
+        state = read_library(user_id)
+        current = state["pdfs"].get(pdf_id)
+        if (current[0] if current else None) == index_key:
+            return
+
+        vectors = load_vectors(index_key) if index_key else None
+        if vectors is None or (state["dim"] is not None and vectors.shape[1] != state["dim"]):
+            # Documents embedded with another model are searched in their own index
+            if current:
+                _append_log(user_id, [{"op": "remove", "pdf_id": pdf_id}])
+                del state["pdfs"][pdf_id]
+        else:
+            records = []
+            if state["generation"] is None:
+                state["generation"], state["dim"] = 0, vectors.shape[1]
+                records.append({"generation": 0, "dim": state["dim"]})
+            path = os.path.join(library_dir(user_id), vectors_file(state["generation"]))
+            with open(path, "ab") as f:
+                # Drop rows an interrupted append wrote but never logged
+                f.truncate(state["rows"] * state["dim"] * 4)
+                f.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            records.append({"op": "add", "pdf_id": pdf_id, "index_key": index_key, "start": state["rows"], "count": len(vectors)})
+            _append_log(user_id, records)
+            state["pdfs"][pdf_id] = (index_key, state["rows"], len(vectors))
+            state["rows"] += len(vectors)
+
+        live = sum(count for _, _, count in state["pdfs"].values())
+        if state["rows"] - live > live:
+            _compact(user_id, state)
+
+
+def _compact(user_id: str, state: dict):
+    """Rewrite the library with only its live rows, as a new generation.
+
+    The new log replaces the old one in a single rename; readers still holding
+    the previous generation's file keep reading it until they are done.
+    """
+    directory = library_dir(user_id)
+    old_path = os.path.join(directory, vectors_file(state["generation"]))
+    generation, dim = state["generation"] + 1, state["dim"]
+    records = [{"generation": generation, "dim": dim}]
+    start = 0
+    old = np.memmap(old_path, dtype=np.float32, mode="r", shape=(state["rows"], dim)) if state["rows"] else None
+    with open(os.path.join(directory, vectors_file(generation)), "wb") as f:
+        for pdf_id, (index_key, first, count) in state["pdfs"].items():
+            f.write(np.ascontiguousarray(old[first:first + count]).tobytes())
+            records.append({"op": "add", "pdf_id": pdf_id, "index_key": index_key, "start": start, "count": count})
+            start += count
+        f.flush()
+        os.fsync(f.fileno())
+
+    tmp_path = os.path.join(directory, LOG_FILE + ".tmp")
+    with open(tmp_path, "w") as f:
+        f.write("".join(json.dumps(record) + "\n" for record in records))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, os.path.join(directory, LOG_FILE))
+    os.remove(old_path)
+
+
+def _search_library_file(user_id: str, members: Dict[str, Tuple[str, str]], query: np.ndarray, k: int):
+    import faiss
+    state = read_library(user_id)
+    ranges = sorted(
+        (start, count, pdf_id) for pdf_id, (index_key, start, count) in state["pdfs"].items()
+        if pdf_id in members and members[pdf_id][1] == index_key and count
+    )
+    hits = []
+    if ranges:
+        vectors = np.memmap(
+            os.path.join(library_dir(user_id), vectors_file(state["generation"])),
+            dtype=np.float32, mode="r", shape=(state["rows"], state["dim"])
+        )
+        # Adjacent documents are scanned as one run of rows
+        runs = []
+        for start, count, _ in ranges:
+            if runs and runs[-1][1] == start:
+                runs[-1][1] = start + count
+            else:
+                runs.append([start, start + count])
+        starts = [start for start, _, _ in ranges]
+        for run_start, run_end in runs:
+            distances, rows = faiss.knn(query, vectors[run_start:run_end], min(k, run_end - run_start))
+            for distance, row in zip(distances[0], rows[0]):
+                if row < 0:
+                    continue
+                start, _, pdf_id = ranges[bisect_right(starts, run_start + int(row)) - 1]
+                hits.append((float(distance), pdf_id, run_start + int(row) - start))
+    return hits, {pdf_id for _, _, pdf_id in ranges}
+
+
+def search_library(user_id: str, members: Dict[str, Tuple[str, str]], query_vector: List[float], k: int) -> List[Document]:
+    """Search the documents in `members` (pdf_id -> (name, index_key)) as one index.
+
+    Membership comes from the caller's PDF rows, so the library only has to
+    be current to be fast: a document whose entry is missing or stale, say
+    while its job is still writing it, is searched in its own stored index.
+    """
+    query = np.array([query_vector], dtype=np.float32)
+    for attempt in range(READ_ATTEMPTS):
+        try:
+            hits, found = _search_library_file(user_id, members, query, k)
+            break
+        except FileNotFoundError:
+            # Compacted between reading the log and opening its vectors file
+            if attempt == READ_ATTEMPTS - 1:
+                raise
+
+    for pdf_id, (_, index_key) in members.items():
+        if pdf_id in found:
+            continue
+        index = read_stored_index(index_key)
+        apply_search_parameters(index, load_manifest(index_key))
+        distances, positions = index.search(query, min(k, index.ntotal))
+        hits.extend((float(distance), pdf_id, int(position)) for distance, position in zip(distances[0], positions[0]) if position >= 0)
+
+    # Text and pages come from each hit's own docstore, opened through the knowledge-base cache
+    documents = []
+    for _, pdf_id, position in sorted(hits)[:k]:
+        name, index_key = members[pdf_id]
+        document = cached_knowledge_base(index_key).document_at(position)
+        documents.append(Document(
+            page_content=document.page_content,
+            metadata={"pdf_id": pdf_id, "page": document.metadata.get("page", "unknown"), "source": name}
+        ))
+    return documents
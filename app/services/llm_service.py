@@ -0,0 +1,72 @@
+from typing import Optional
+
+import httpx
+from fastapi import Request
+
+from app.config import settings
+from app.services.chat_service import PROMPT_TEMPLATE, CONDENSE_PROMPT, SUMMARY_PROMPT
+
+
+def http_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=settings.LLM_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.LLM_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=settings.LLM_KEEPALIVE_EXPIRY,
+    )
+
+
+def create_llm(http_client: Optional[httpx.Client] = None, async_http_client: Optional[httpx.AsyncClient] = None):
+    # Provider SDKs are imported on first use; they dominate a worker's import time
+    if settings.LLM_PROVIDER == "fake":
+        from app.services.fake_llm import FakeStreamingLLM
+        return FakeStreamingLLM(latency=settings.FAKE_LLM_LATENCY, token_delay=settings.FAKE_LLM_TOKEN_DELAY)
+    if settings.LLM_PROVIDER == "openai":
+        import openai
+        from langchain_community.llms.openai import OpenAI
+        if http_client is None:
+            return OpenAI(model=settings.LLM_MODEL)
+        # Hand LangChain ready-made completions resources so every call reuses the
+        # same pooled, keep-alive connections instead of opening new ones
+        client_params = {"api_key": settings.OPENAI_API_KEY, "timeout": settings.LLM_TIMEOUT}
+        return OpenAI(
+            model=settings.LLM_MODEL,
+            openai_api_key=settings.OPENAI_API_KEY,
+            client=openai.OpenAI(http_client=http_client, **client_params).completions,
+            async_client=openai.AsyncOpenAI(http_client=async_http_client, **client_params).completions,
+        )
+    raise ValueError(f"Unknown LLM_PROVIDER: {settings.LLM_PROVIDER}")
+
+
+class LLMRegistry:
+    """Process-wide LLM clients and chains, built once in the app lifespan.
+
+    Requests only bind their per-PDF inputs to the shared chain, so nothing is
+    constructed and no connection is opened per question.
+    """
+
+    def __init__(self):
+        self.http_client = None
+        self.async_http_client = None
+        if settings.LLM_PROVIDER == "openai":
+            self.http_client = httpx.Client(limits=http_limits(), timeout=settings.LLM_TIMEOUT)
+            self.async_http_client = httpx.AsyncClient(limits=http_limits(), timeout=settings.LLM_TIMEOUT)
+        self.llm = create_llm(self.http_client, self.async_http_client)
+        self.qa_chain = PROMPT_TEMPLATE | self.llm
+        self.condense_chain = CONDENSE_PROMPT | self.llm
+        self.summary_chain = SUMMARY_PROMPT | self.llm
+
+    async def aclose(self):
+        if self.async_http_client is not None:
+            await self.async_http_client.aclose()
+        if self.http_client is not None:
+            self.http_client.close()
+
+
+def get_llm_registry(request: Request) -> LLMRegistry:
+    return request.app.state.llm_registry
+
+
+def usage_callback():
+    """`get_openai_callback()`, importing langchain_community on first use."""
+    from langchain_community.callbacks.manager import get_openai_callback
+    return get_openai_callback()
@@ -0,0 +1,144 @@
+from typing import List, Optional, Tuple
+
+from sqlalchemy import select, update, func
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import settings
+from app.models.chat_history_model import ChatHistory
+from app.models.chat_message_model import ChatMessage
+from app.services.token_service import count_tokens, truncate_tokens
+from app.services.llm_service import usage_callback
+from app.services.metrics_service import record_llm_usage
+from app.services.upstream_scheduler import upstream_scheduler, flight_key
+
+
+def format_turn(question: str, answer: str) -> str:
+    return f"User: {question}\nAssistant: {answer}"
+
+
+async def count_turns(db: AsyncSession, conversation: ChatHistory) -> int:
+    return await db.scalar(
+        select(func.count()).select_from(ChatMessage).where(ChatMessage.conversation_id == conversation.id)
+    )
+
+
+async def fold_into_summary(db: AsyncSession, conversation: ChatHistory, summary_chain, total: int,
+                            user_id: Optional[str] = None) -> int:
+    """Fold turns that have slid out of the recent window into the rolling summary.
+
+    Nothing is folded until HISTORY_SUMMARY_BATCH turns have built up past the
+    window, so most questions make no summary call; those turns stay verbatim in
+    the history meanwhile. Older unsummarized turns, such as a long history from
+    before conversational mode, are skipped. Returns the number of turns folded.
+    """
+    summarized = conversation.summarized_messages or 0
+    covered = total - settings.HISTORY_WINDOW_TURNS
+    if covered - summarized < settings.HISTORY_SUMMARY_BATCH:
+        return 0
+
+    start = max(summarized, covered - settings.HISTORY_SUMMARY_BATCH)
+    turns = (await db.execute(
+        select(ChatMessage.question, ChatMessage.answer)
+        .where(ChatMessage.conversation_id == conversation.id)
+        .order_by(ChatMessage.created_at, ChatMessage.id)
+        .offset(start)
+        .limit(covered - start)
+    )).all()
+
+    # Each turn gets an equal share of the budget, so one long answer cannot crowd out the rest
+    turn_tokens = max(settings.HISTORY_TOKEN_BUDGET // len(turns), 1)
+    inputs = {
+        "summary": conversation.summary or "(none yet)",
+        "turns": "\n\n".join(truncate_tokens(format_turn(turn.question, turn.answer), turn_tokens) for turn in turns),
+        "max_words": settings.HISTORY_SUMMARY_TOKENS * 3 // 4,
+    }
+    # Concurrent questions folding the same turns share one summarization call
+    summary = await upstream_scheduler.run(
+        lambda: summary_chain.ainvoke(inputs), user_id,
+        key=flight_key("summary", conversation.id, summarized, covered)
+    )
+    summary = truncate_tokens(summary.strip(), settings.HISTORY_SUMMARY_TOKENS)
+
+    # Only the first of the questions that folded these turns stores the summary
+    result = await db.execute(
+        update(ChatHistory)
+        .where(ChatHistory.id == conversation.id, ChatHistory.summarized_messages == summarized)
+        .values(summary=summary, summarized_messages=covered)
+    )
+    await db.commit()
+    await db.refresh(conversation)
+    return covered - summarized if result.rowcount else 0
+
+
+async def build_history(db: AsyncSession, conversation: ChatHistory, total: int) -> Tuple[str, dict]:
+    """The conversation's summary plus as many recent turns as fit HISTORY_TOKEN_BUDGET.
+
+    Recent turns are those the summary does not cover yet: the window plus fewer
+    than HISTORY_SUMMARY_BATCH waiting to be folded. The summary is capped at
+    HISTORY_SUMMARY_TOKENS, so the history stays bounded however long the
+    conversation gets. Older turns are dropped first.
+    """
+    pending = min(
+        total - (conversation.summarized_messages or 0),
+        settings.HISTORY_WINDOW_TURNS + settings.HISTORY_SUMMARY_BATCH
+    )
+    recent = []
+    if pending > 0:
+        recent = (await db.execute(
+            select(ChatMessage.question, ChatMessage.answer)
+            .where(ChatMessage.conversation_id == conversation.id)
+            .order_by(ChatMessage.created_at.desc(), ChatMessage.id.desc())
+            .limit(pending)
+        )).all()
+
+    sections: List[str] = []
+    used = 0
+    if conversation.summary:
+        sections.append(f"Summary of earlier conversation: {conversation.summary}")
+        used = count_tokens(sections[0])
+
+    turns: List[str] = []
+    for turn in recent:
+        text = format_turn(turn.question, turn.answer)
+        tokens = count_tokens(text)
+        if used + tokens > settings.HISTORY_TOKEN_BUDGET:
+            if turns or used >= settings.HISTORY_TOKEN_BUDGET:
+                break
+            # The latest turn is what a follow-up usually refers to, so keep its start
+            text = truncate_tokens(text, settings.HISTORY_TOKEN_BUDGET - used)
+            tokens = count_tokens(text)
+        turns.insert(0, text)
+        used += tokens
+
+    return "\n\n".join(sections + turns), {
+        "history_turns": len(turns),
+        "history_summarized_turns": conversation.summarized_messages or 0,
+        "history_tokens": used,
+        "history_budget": settings.HISTORY_TOKEN_BUDGET,
+    }
+
+
+async def condense_question(db: AsyncSession, conversation: ChatHistory, question: str, llm_registry,
+                            user_id: Optional[str] = None) -> Tuple[str, dict]:
+    """Rewrite a follow-up into a standalone question using the conversation's memory.
+
+    Returns the standalone question, used for retrieval, the answer cache and
+    the answer prompt, along with history token stats.
+    """
+    with usage_callback() as cb:
+        total = await count_turns(db, conversation)
+        await fold_into_summary(db, conversation, llm_registry.summary_chain, total, user_id)
+        history, stats = await build_history(db, conversation, total)
+        standalone = question
+        if history:
+            inputs = {"history": history, "question": question}
+            condensed = await upstream_scheduler.run(
+                lambda: llm_registry.condense_chain.ainvoke(inputs), user_id, key=flight_key("condense", inputs)
+            )
+            standalone = condensed.strip() or question
+
+    record_llm_usage("memory", cb)
+    stats["standalone_question"] = standalone
+    stats["memory_openai_tokens"] = cb.total_tokens
+    stats["memory_openai_cost"] = cb.total_cost
+    return standalone, stats
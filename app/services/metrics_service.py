@@ -0,0 +1,157 @@
+import time
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+from prometheus_client import Counter, Gauge, Histogram, REGISTRY
+from prometheus_client.core import GaugeMetricFamily, CounterMetricFamily
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+STAGE_SECONDS = Histogram(
+    "chatpdf_stage_seconds", "Time spent in each stage of a request or ingestion job",
+    ["flow", "stage"], buckets=STAGE_BUCKETS
+)
+REQUEST_SECONDS = Histogram(
+    "chatpdf_request_seconds", "HTTP request latency until the response is complete",
+    ["method", "route", "status"], buckets=STAGE_BUCKETS
+)
+LLM_TOKENS = Counter("chatpdf_llm_tokens", "Tokens reported by OpenAI", ["purpose", "kind"])
+LLM_COST = Counter("chatpdf_llm_cost_usd", "Estimated OpenAI cost in US dollars", ["purpose"])
+CONTEXT_CHUNKS = Counter("chatpdf_context_chunks", "Retrieved chunks by what prompt packing did with them", ["outcome"])
+INGESTED_CHUNKS = Counter("chatpdf_ingested_chunks", "Chunks written by ingestion and revisions", ["outcome"])
+INGESTION_JOBS = Counter("chatpdf_ingestion_jobs", "Finished background jobs", ["job", "result"])
+ERRORS = Counter("chatpdf_errors", "Failed requests and background jobs by the stage that raised", ["flow", "stage"])
+UPSTREAM_WAIT_SECONDS = Histogram(
+    "chatpdf_upstream_wait_seconds", "Time LLM and embedding calls waited for admission",
+    ["priority"], buckets=STAGE_BUCKETS
+)
+UPSTREAM_CALLS = Counter("chatpdf_upstream_calls", "LLM and embedding calls by admission outcome", ["priority", "outcome"])
+UPSTREAM_IN_FLIGHT = Gauge("chatpdf_upstream_in_flight", "LLM and embedding calls running")
+UPSTREAM_WAITING = Gauge("chatpdf_upstream_waiting", "LLM and embedding calls waiting for admission")
+
+# Stage timings of the current request, collected only when it asked for Server-Timing
+_request_timings: ContextVar[Optional[list]] = ContextVar("request_timings", default=None)
+
+
+def observe_stage(flow: str, stage: str, elapsed: float):
+    STAGE_SECONDS.labels(flow, stage).observe(elapsed)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.append((stage, elapsed))
+
+
+@contextmanager
+def timed(flow: str, stage: str):
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception as error:
+        # The innermost stage an error passes through is the one that raised it
+        if getattr(error, "failed_stage", None) is None:
+            error.failed_stage = stage
+        raise
+    finally:
+        observe_stage(flow, stage, time.perf_counter() - start)
+
+
+def record_error(flow: str, error: BaseException, **context):
+    """Count an error under the stage that raised it and log it with its context."""
+    stage = getattr(error, "failed_stage", None) or "other"
+    ERRORS.labels(flow, stage).inc()
+    details = "".join(f" {key}={value}" for key, value in context.items())
+    logger.error("%s failed in stage %s%s: %s", flow, stage, details, error, exc_info=error)
+
+
+def record_llm_usage(purpose: str, callback):
+    LLM_TOKENS.labels(purpose, "prompt").inc(callback.prompt_tokens)
+    LLM_TOKENS.labels(purpose, "completion").inc(callback.completion_tokens)
+    LLM_COST.labels(purpose).inc(callback.total_cost)
+
+
+def record_context_packing(usage: dict):
+    CONTEXT_CHUNKS.labels("packed").inc(usage["chunks_packed"])
+    CONTEXT_CHUNKS.labels("dropped_redundant").inc(usage["dropped_redundant"])
+    CONTEXT_CHUNKS.labels("dropped_over_budget").inc(usage["dropped_over_budget"])
+
+
+def server_timing(timings: list, total: float) -> bytes:
+    entries = [f"{stage};dur={elapsed * 1000:.2f}" for stage, elapsed in timings]
+    entries.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(entries).encode("latin-1")
+
+
+class MetricsMiddleware:
+    """Times every HTTP request and optionally returns its stage timings.
+
+    Timings are sent in a Server-Timing header when SERVER_TIMING is on or
+    the request carries `X-Server-Timing: 1`. Streaming responses send their
+    headers before generation starts, so their header only covers the stages
+    run before the stream opened.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        traced = settings.SERVER_TIMING or dict(scope["headers"]).get(b"x-server-timing") == b"1"
+        timings = [] if traced else None
+        token = _request_timings.set(timings)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if timings is not None:
+                    message["headers"] = list(message.get("headers", [])) + [
+                        (b"server-timing", server_timing(timings, time.perf_counter() - start))
+                    ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            # Label by route template, so ids in paths do not create a series each
+            route = scope.get("route")
+            REQUEST_SECONDS.labels(
+                scope["method"], route.path if route else "unmatched", str(status)
+            ).observe(time.perf_counter() - start)
+            _request_timings.reset(token)
+
+
+class CacheCollector:
+    """Exports the in-process caches' own stats at scrape time."""
+
+    def __init__(self, caches: dict):
+        self.caches = caches
+
+    def collect(self):
+        entries = GaugeMetricFamily("chatpdf_cache_entries", "Entries held by each cache", labels=["cache"])
+        hits = CounterMetricFamily("chatpdf_cache_hits", "Cache hits", labels=["cache"])
+        misses = CounterMetricFamily("chatpdf_cache_misses", "Cache misses", labels=["cache"])
+        evictions = CounterMetricFamily("chatpdf_cache_evictions", "Entries evicted to stay within limits", labels=["cache"])
+        size = GaugeMetricFamily("chatpdf_cache_bytes", "Bytes held by caches that track their size", labels=["cache"])
+        for name, cache in self.caches.items():
+            stats = cache.stats()
+            entries.add_metric([name], stats["entries"])
+            hits.add_metric([name], stats["hits"])
+            misses.add_metric([name], stats["misses"])
+            evictions.add_metric([name], stats["evictions"])
+            if "bytes" in stats:
+                size.add_metric([name], stats["bytes"])
+        return [entries, hits, misses, evictions, size]
+
+
+def register_cache_metrics(caches: dict):
+    REGISTRY.register(CacheCollector(caches))
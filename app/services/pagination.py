@@ -0,0 +1,18 @@
+import json
+import base64
+import datetime
+
+from fastapi import HTTPException
+
+
+# Opaque keyset cursors over (timestamp, id), the ordering every paginated listing uses
+def encode_cursor(timestamp: datetime.datetime, row_id: str) -> str:
+    payload = json.dumps([timestamp.isoformat(), row_id])
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+def decode_cursor(cursor: str):
+    try:
+        timestamp, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.datetime.fromisoformat(timestamp), row_id
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail='Invalid cursor')
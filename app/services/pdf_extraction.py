@@ -0,0 +1,68 @@
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from app.config import settings
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Spawn rather than fork: ingestion runs on threads, and forking a
+            # threaded process can deadlock the child on inherited locks
+            _pool = ProcessPoolExecutor(
+                max_workers=settings.EXTRACT_PROCESSES,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _pool
+
+
+def _extract_page_range(pdf_path: str, start: int, stop: int):
+    from pypdf import PdfReader
+    with open(pdf_path, "rb") as f:
+        reader = PdfReader(f)
+        return [reader.pages[i].extract_text() or '' for i in range(start, stop)]
+
+
+def iter_pages(pdf_path: str):
+    """Yield (page_number, text) for each page in order, page numbers starting at 1.
+
+    The document is read from disk as pages are needed, never loaded whole.
+    Small documents are extracted inline. Large ones are split into page ranges
+    extracted by a process pool, with only a few ranges in flight at a time so
+    memory stays bounded however many pages the document has.
+    """
+    from pypdf import PdfReader
+    # PdfReader copies a document given by path into memory; given a file, it seeks
+    with open(pdf_path, "rb") as f:
+        reader = PdfReader(f)
+        page_count = len(reader.pages)
+
+        if page_count < settings.PARALLEL_EXTRACT_MIN_PAGES or settings.EXTRACT_PROCESSES <= 1:
+            for page_number, page in enumerate(reader.pages, start=1):
+                yield page_number, page.extract_text() or ''
+            return
+
+    del reader
+    batch = settings.EXTRACT_BATCH_PAGES
+    ranges = deque((start, min(start + batch, page_count)) for start in range(0, page_count, batch))
+
+    # Workers open the document from disk themselves
+    pool = _get_pool()
+    in_flight = deque()
+    try:
+        while ranges or in_flight:
+            while ranges and len(in_flight) < settings.EXTRACT_PROCESSES * 2:
+                start, stop = ranges.popleft()
+                in_flight.append((start, pool.submit(_extract_page_range, pdf_path, start, stop)))
+            start, future = in_flight.popleft()
+            for offset, text in enumerate(future.result()):
+                yield start + offset + 1, text
+    finally:
+        for _, future in in_flight:
+            future.cancel()
@@ -0,0 +1,112 @@
+import time
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from app.config import settings
+from app.models.user_model import User
+
+
+class PrincipalCache:
+    """Per-worker cache of authenticated users, keyed by auth token.
+
+    Saves decoding the JWT and loading the user on every request. Entries
+    live for `ttl` seconds, never past the token's own expiry, and the least
+    recently used is evicted once `max_entries` is reached. Logout drops the
+    token's entry and deactivation drops every entry of the user; other
+    workers catch up within `ttl`.
+    """
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # token -> (user snapshot, expires_at)
+        self._by_user = {}  # user_id -> set of tokens
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, token: str) -> Optional[User]:
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None or entry[1] <= time.monotonic():
+                if entry is not None:
+                    self._remove(token)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(token)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, token: str, user: User, token_expires_at: Optional[float] = None):
+        if self.max_entries <= 0 or self.ttl <= 0:
+            return
+        ttl = self.ttl
+        if token_expires_at is not None:
+            ttl = min(ttl, token_expires_at - time.time())
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._remove(token)
+            self._entries[token] = (user, time.monotonic() + ttl)
+            self._by_user.setdefault(user.id, set()).add(token)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate_token(self, token: str):
+        with self._lock:
+            self._remove(token)
+
+    def invalidate_user(self, user_id: str):
+        with self._lock:
+            for token in list(self._by_user.get(user_id, ())):
+                self._remove(token)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_user.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+            }
+
+    def _remove(self, token: str):
+        entry = self._entries.pop(token, None)
+        if entry is None:
+            return
+        tokens = self._by_user.get(entry[0].id)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._by_user[entry[0].id]
+
+
+def user_snapshot(user: User) -> User:
+    # A transient copy without the password hash: it belongs to no session, so
+    # concurrent requests can share it and no rollback or refresh can expire it
+    return User(
+        id=user.id,
+        email=user.email,
+        full_name=user.full_name,
+        is_active=user.is_active,
+        session_id=user.session_id,
+        created_at=user.created_at
+    )
+
+
+principal_cache = PrincipalCache(
+    max_entries=settings.AUTH_CACHE_MAX_ENTRIES,
+    ttl=settings.AUTH_CACHE_TTL
+)
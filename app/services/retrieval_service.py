@@ -0,0 +1,92 @@
+import threading
+from typing import List, Optional
+
+import numpy as np
+from langchain_core.documents import Document
+
+from app.config import settings
+from app.services.bm25_index import BM25Index
+
+
+def reciprocal_rank_fusion(rankings: List[List[int]], rrf_k: int) -> List[int]:
+    """Merge ranked lists of chunk positions, scoring each by sum(1 / (rrf_k + rank))."""
+    scores = {}
+    for ranking in rankings:
+        for rank, position in enumerate(ranking, start=1):
+            scores[position] = scores.get(position, 0.0) + 1.0 / (rrf_k + rank)
+    return sorted(scores, key=lambda position: scores[position], reverse=True)
+
+
+class NoopReranker:
+    """Keeps the fused order."""
+
+    def rerank(self, query: str, documents: List[Document], k: int) -> List[Document]:
+        return documents[:k]
+
+
+class CrossEncoderReranker:
+    """Scores (question, chunk) pairs with a local cross-encoder model."""
+
+    def __init__(self, model_name: str):
+        try:
+            from sentence_transformers import CrossEncoder
+        except ImportError as error:
+            raise ValueError("RERANKER=cross-encoder needs the sentence-transformers package") from error
+        self.model = CrossEncoder(model_name)
+
+    def rerank(self, query: str, documents: List[Document], k: int) -> List[Document]:
+        if not documents:
+            return []
+        scores = self.model.predict([(query, document.page_content) for document in documents])
+        order = np.argsort(-np.asarray(scores))
+        return [documents[i] for i in order[:k]]
+
+
+def create_reranker():
+    if settings.RERANKER == "none":
+        return NoopReranker()
+    if settings.RERANKER == "cross-encoder":
+        return CrossEncoderReranker(settings.RERANKER_MODEL)
+    raise ValueError(f"Unknown RERANKER: {settings.RERANKER}")
+
+
+_reranker = None
+_reranker_lock = threading.Lock()
+
+
+def get_reranker():
+    global _reranker
+    with _reranker_lock:
+        if _reranker is None:
+            _reranker = create_reranker()
+        return _reranker
+
+
+class HybridRetriever:
+    """A knowledge base's FAISS index paired with its BM25 index.
+
+    Dense and lexical candidates are merged with reciprocal rank fusion, so
+    exact terms such as clause numbers or SKUs are found even when their
+    embedding is not close to the question's, and then re-ranked down to k.
+    """
+
+    def __init__(self, vector_store, bm25: BM25Index):
+        self.vector_store = vector_store
+        self.bm25 = bm25
+
+    @property
+    def embeddings(self):
+        return self.vector_store.embeddings
+
+    def document_at(self, position: int) -> Document:
+        return self.vector_store.docstore.search(self.vector_store.index_to_docstore_id[position])
+
+    def search(self, query: str, query_vector: List[float], k: int, fetch_k: Optional[int] = None) -> List[Document]:
+        fetch_k = max(fetch_k or settings.RETRIEVAL_FETCH_K, k)
+
+        _, dense = self.vector_store.index.search(np.array([query_vector], dtype=np.float32), fetch_k)
+        dense_ranking = [int(position) for position in dense[0] if position >= 0]
+        lexical_ranking = [position for position, _ in self.bm25.search(query, fetch_k)]
+
+        fused = reciprocal_rank_fusion([dense_ranking, lexical_ranking], settings.RRF_K)[:fetch_k]
+        return get_reranker().rerank(query, [self.document_at(position) for position in fused], k)
@@ -0,0 +1,131 @@
+import re
+import hashlib
+import logging
+import threading
+from typing import List
+
+from langchain_core.documents import Document
+from langchain_core.prompts import PromptTemplate, format_document
+
+from app.config import settings
+
+# Split at section headings first, then paragraphs, lines, sentences and words
+SPLIT_SEPARATORS = [
+    r"\n(?=(?:Section|SECTION|Article|ARTICLE|Chapter|CHAPTER|Clause|CLAUSE|Schedule|SCHEDULE|Appendix|APPENDIX)\s)",
+    r"\n\s*\n",
+    r"\n",
+    r"(?<=[.!?;])\s+",
+    r"\s+",
+    "",
+]
+APPROXIMATE_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+logger = logging.getLogger(__name__)
+
+_encoding = None
+_encoding_lock = threading.Lock()
+
+
+def get_encoding():
+    """The tiktoken encoding of LLM_MODEL, or None when it cannot be loaded.
+
+    tiktoken downloads its BPE files on first use; without network access
+    token counts fall back to a word-and-punctuation approximation. Servers
+    load it at startup (see main.py and app/preload.py), so requests never
+    wait on the download.
+    """
+    global _encoding
+    if _encoding is not None:
+        return _encoding or None
+    with _encoding_lock:
+        if _encoding is None:
+            try:
+                import tiktoken
+                try:
+                    _encoding = tiktoken.encoding_for_model(settings.LLM_MODEL)
+                except KeyError:
+                    _encoding = tiktoken.get_encoding("cl100k_base")
+            except Exception as error:
+                logger.warning("tiktoken unavailable, approximating token counts: %s", str(error)[:200])
+                _encoding = False
+        return _encoding or None
+
+
+def count_tokens(text: str) -> int:
+    encoding = get_encoding()
+    if encoding is None:
+        return len(APPROXIMATE_TOKEN_PATTERN.findall(text))
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    encoding = get_encoding()
+    if encoding is None:
+        matches = list(APPROXIMATE_TOKEN_PATTERN.finditer(text))
+        return text if len(matches) <= max_tokens else text[:matches[max_tokens].start()].rstrip()
+    tokens = encoding.encode(text, disallowed_special=())
+    return text if len(tokens) <= max_tokens else encoding.decode(tokens[:max_tokens])
+
+
+def create_text_splitter():
+    # Only ingestion splits text, so serving workers never pay for this import
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+    return RecursiveCharacterTextSplitter(
+        chunk_size=settings.CHUNK_TOKENS,
+        chunk_overlap=settings.CHUNK_OVERLAP_TOKENS,
+        length_function=count_tokens,
+        separators=SPLIT_SEPARATORS,
+        is_separator_regex=True,
+        keep_separator=True,
+    )
+
+
+def _shingles(text: str, size: int = 5) -> set:
+    words = text.lower().split()
+    if len(words) < size:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def pack_context(documents: List[Document], document_prompt: PromptTemplate, budget: int):
+    """Choose the chunks to send, in rank order, within `budget` tokens.
+
+    A chunk is dropped as redundant when most of its word 5-grams already
+    appear in chunks packed before it (repeated boilerplate, or neighbours
+    sharing their split overlap), and skipped when it no longer fits the
+    remaining budget. Returns the packed chunks and packing stats.
+    """
+    packed, seen_hashes, seen_shingles = [], set(), set()
+    used = dropped_redundant = dropped_budget = 0
+    for document in documents:
+        digest = hashlib.sha256(document.page_content.encode("utf-8")).hexdigest()
+        shingles = _shingles(document.page_content)
+        if digest in seen_hashes or len(shingles & seen_shingles) >= settings.CONTEXT_REDUNDANCY * len(shingles):
+            dropped_redundant += 1
+            continue
+
+        tokens = count_tokens(format_document(document, document_prompt))
+        if used + tokens > budget:
+            if packed:
+                dropped_budget += 1
+                continue
+            # Never send an empty context because the best chunk alone is too large
+            document = Document(
+                page_content=truncate_tokens(document.page_content, max(budget - (tokens - count_tokens(document.page_content)), 1)),
+                metadata=document.metadata
+            )
+            tokens = count_tokens(format_document(document, document_prompt))
+
+        packed.append(document)
+        seen_hashes.add(digest)
+        seen_shingles |= shingles
+        used += tokens
+
+    return packed, {
+        "chunks_retrieved": len(documents),
+        "chunks_packed": len(packed),
+        "dropped_redundant": dropped_redundant,
+        "dropped_over_budget": dropped_budget,
+        "context_tokens": used,
+        "context_budget": budget,
+    }
@@ -0,0 +1,101 @@
+import os
+import hashlib
+import tempfile
+from typing import Tuple
+
+from fastapi import HTTPException, UploadFile
+from starlette.responses import JSONResponse
+
+from app.config import settings
+
+PDF_MAGIC = b"%PDF-"
+# The PDF header may follow a little leading junk, which readers tolerate
+MAGIC_SEARCH_BYTES = 1024
+# Multipart boundaries and part headers around the file itself
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+
+def discard_upload(pdf_path: str):
+    try:
+        os.remove(pdf_path)
+    except FileNotFoundError:
+        pass
+
+
+def _too_large() -> HTTPException:
+    return HTTPException(status_code=413, detail=f'PDF is larger than the {round(settings.UPLOAD_MAX_BYTES / (1024 * 1024), 1):g} MB limit')
+
+
+def count_pages(pdf_path: str) -> int:
+    # Only the cross-reference table and page tree are read, not the page contents
+    from pypdf import PdfReader
+    try:
+        with open(pdf_path, "rb") as f:
+            return len(PdfReader(f).pages)
+    except Exception:
+        raise HTTPException(status_code=400, detail='Uploaded file is not a readable PDF')
+
+
+def spool_upload(file: UploadFile) -> Tuple[str, int, str]:
+    """Copy an upload to a file under UPLOAD_SPOOL_DIR in UPLOAD_READ_BYTES reads.
+
+    The SHA-256 fingerprint and size are computed while copying, and uploads
+    are rejected as soon as they turn out not to be a PDF, to exceed
+    UPLOAD_MAX_BYTES or to have more than UPLOAD_MAX_PAGES pages. Returns
+    (path, size, fingerprint); the caller owns the file from then on.
+    """
+    os.makedirs(settings.UPLOAD_SPOOL_DIR, exist_ok=True)
+    spool = tempfile.NamedTemporaryFile(dir=settings.UPLOAD_SPOOL_DIR, suffix=".pdf", delete=False)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with spool:
+            while True:
+                block = file.file.read(settings.UPLOAD_READ_BYTES)
+                if not block:
+                    break
+                if size == 0 and PDF_MAGIC not in block[:MAGIC_SEARCH_BYTES]:
+                    raise HTTPException(status_code=400, detail='Uploaded file is not a PDF')
+                size += len(block)
+                if size > settings.UPLOAD_MAX_BYTES:
+                    raise _too_large()
+                digest.update(block)
+                spool.write(block)
+        if size == 0:
+            raise HTTPException(status_code=400, detail='Uploaded file is empty')
+
+        page_count = count_pages(spool.name)
+        if page_count > settings.UPLOAD_MAX_PAGES:
+            raise HTTPException(
+                status_code=413, detail=f'PDF has {page_count} pages, the limit is {settings.UPLOAD_MAX_PAGES}'
+            )
+    except BaseException:
+        discard_upload(spool.name)
+        raise
+    return spool.name, size, digest.hexdigest()
+
+
+class UploadLimitMiddleware:
+    """Refuses multipart requests whose declared length is over UPLOAD_MAX_BYTES.
+
+    The multipart body is parsed before a route runs, so this is the only place
+    an oversized upload can be turned away before it is received. Requests
+    without a Content-Length are still stopped by `spool_upload`.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            headers = dict(scope["headers"])
+            length = headers.get(b"content-length")
+            if (
+                headers.get(b"content-type", b"").startswith(b"multipart/form-data")
+                and length is not None and length.isdigit()
+                and int(length) > settings.UPLOAD_MAX_BYTES + MULTIPART_OVERHEAD_BYTES
+            ):
+                response = JSONResponse({"detail": _too_large().detail}, status_code=413, headers={"Connection": "close"})
+                await response(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
@@ -0,0 +1,334 @@
+import json
+import math
+import time
+import asyncio
+import hashlib
+from bisect import insort
+from collections import Counter
+from contextlib import contextmanager, asynccontextmanager
+from contextvars import ContextVar
+from functools import partial
+from typing import Optional
+
+from fastapi import HTTPException
+
+from app.config import settings
+from app.services.metrics_service import UPSTREAM_WAIT_SECONDS, UPSTREAM_CALLS, UPSTREAM_IN_FLIGHT, UPSTREAM_WAITING
+
+INTERACTIVE = 0
+BULK = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BULK: "bulk"}
+
+# Set by ingestion jobs, so embeddings made on their threads queue as that user's bulk work
+_bulk_user: ContextVar[Optional[str]] = ContextVar("upstream_bulk_user", default=None)
+
+
+class UpstreamBusy(Exception):
+    def __init__(self, retry_after: int):
+        super().__init__(f"Upstream capacity exhausted, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+def busy_error(busy: UpstreamBusy) -> HTTPException:
+    return HTTPException(
+        status_code=429,
+        detail='Too many questions are waiting for the language model, please try again shortly',
+        headers={"Retry-After": str(busy.retry_after)}
+    )
+
+
+def flight_key(*parts) -> str:
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+@contextmanager
+def bulk_work(user_id: str):
+    token = _bulk_user.set(user_id)
+    try:
+        yield
+    finally:
+        _bulk_user.reset(token)
+
+
+def bulk_user() -> Optional[str]:
+    return _bulk_user.get()
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+
+    def wait_time(self) -> float:
+        # Seconds until a call may start; refills as a side effect
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        if self.rate > 0:
+            self.tokens -= 1
+
+
+class _Waiter:
+    __slots__ = ("priority", "seq", "user", "future")
+
+    def __init__(self, priority: int, seq: int, user: Optional[str], future: asyncio.Future):
+        self.priority = priority
+        self.seq = seq
+        self.user = user
+        self.future = future
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class UpstreamScheduler:
+    """Admission control in front of the LLM and embedding providers.
+
+    Calls wait in one queue, interactive before bulk and oldest first, and
+    start when the global, per-user and bulk concurrency limits and the token
+    bucket allow. Interactive calls are refused with UpstreamBusy when
+    UPSTREAM_MAX_QUEUE are already waiting or after UPSTREAM_QUEUE_TIMEOUT;
+    bulk calls wait as long as it takes. Calls sharing a key while one is in
+    flight share its result instead of calling upstream again.
+
+    State lives on the event loop bound at startup; worker threads queue through
+    `call_threadsafe`. Unbound, as in scripts, calls run straight through.
+    """
+
+    def __init__(self, max_concurrency: int, user_concurrency: int, bulk_concurrency: int,
+                 rate: float, burst: int, max_queue: int, queue_timeout: float):
+        self.max_concurrency = max(max_concurrency, 1)
+        self.user_concurrency = max(user_concurrency, 1)
+        self.bulk_concurrency = max(bulk_concurrency, 1)
+        self.bucket = TokenBucket(rate, burst)
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._loop = None
+        self._waiting = []
+        self._running = 0
+        self._running_bulk = 0
+        self._per_user = Counter()
+        self._flights = {}
+        self._timer = None
+        self._seq = 0
+        # Moving average of call duration, for Retry-After estimates
+        self._service_seconds = 1.0
+        self.admitted = 0
+        self.rejected = 0
+        self.coalesced = 0
+
+    def bind(self, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+
+    def close(self):
+        # Waiting worker threads would otherwise block forever once the loop stops
+        self._loop = None
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        for waiter in self._waiting:
+            if not waiter.future.done():
+                waiter.future.set_exception(UpstreamBusy(1))
+        self._waiting.clear()
+        UPSTREAM_WAITING.set(0)
+
+    def retry_after(self) -> int:
+        throughput = self.max_concurrency / max(self._service_seconds, 0.001)
+        if self.bucket.rate > 0:
+            throughput = min(throughput, self.bucket.rate)
+        return max(1, math.ceil(len(self._waiting) / throughput))
+
+    def check_queue(self):
+        """Refuse an interactive call up front when too many are already waiting."""
+        if self._loop is None:
+            return
+        waiting = sum(1 for waiter in self._waiting if waiter.priority == INTERACTIVE)
+        if waiting >= self.max_queue:
+            self.rejected += 1
+            UPSTREAM_CALLS.labels(PRIORITY_NAMES[INTERACTIVE], "rejected").inc()
+            raise UpstreamBusy(self.retry_after())
+
+    def _fits(self, priority: int, user: Optional[str]) -> bool:
+        if self._running >= self.max_concurrency:
+            return False
+        if user is not None and self._per_user[user] >= self.user_concurrency:
+            return False
+        return priority != BULK or self._running_bulk < self.bulk_concurrency
+
+    def _start(self, priority: int, user: Optional[str]):
+        self._running += 1
+        self._per_user[user] += 1
+        if priority == BULK:
+            self._running_bulk += 1
+        self.bucket.take()
+        self.admitted += 1
+        UPSTREAM_IN_FLIGHT.set(self._running)
+
+    def _release(self, priority: int, user: Optional[str], elapsed: float):
+        self._running -= 1
+        self._per_user[user] -= 1
+        if self._per_user[user] <= 0:
+            del self._per_user[user]
+        if priority == BULK:
+            self._running_bulk -= 1
+        self._service_seconds = 0.9 * self._service_seconds + 0.1 * elapsed
+        UPSTREAM_IN_FLIGHT.set(self._running)
+        if self._loop is not None:
+            self._dispatch()
+
+    def _dispatch(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        # Start the first waiters in priority order that their limits allow
+        i = 0
+        while i < len(self._waiting) and self._running < self.max_concurrency:
+            waiter = self._waiting[i]
+            if not self._fits(waiter.priority, waiter.user):
+                i += 1
+                continue
+            delay = self.bucket.wait_time()
+            if delay > 0:
+                self._timer = self._loop.call_later(delay, self._dispatch)
+                break
+            self._waiting.pop(i)
+            self._start(waiter.priority, waiter.user)
+            waiter.future.set_result(None)
+        UPSTREAM_WAITING.set(len(self._waiting))
+
+    def _abandon(self, waiter: _Waiter):
+        if waiter in self._waiting:
+            self._waiting.remove(waiter)
+            UPSTREAM_WAITING.set(len(self._waiting))
+        elif waiter.future.done() and not waiter.future.cancelled() and waiter.future.exception() is None:
+            # Admitted just as the caller gave up
+            self._release(waiter.priority, waiter.user, 0.0)
+
+    async def acquire(self, priority: int, user: Optional[str]):
+        if self._loop is None:
+            return
+        if priority == INTERACTIVE:
+            self.check_queue()
+        self._seq += 1
+        waiter = _Waiter(priority, self._seq, user, self._loop.create_future())
+        insort(self._waiting, waiter)
+        self._dispatch()
+
+        start = time.perf_counter()
+        try:
+            if priority == INTERACTIVE and self.queue_timeout > 0:
+                await asyncio.wait_for(waiter.future, self.queue_timeout)
+            else:
+                await waiter.future
+        except asyncio.TimeoutError:
+            self._abandon(waiter)
+            self.rejected += 1
+            UPSTREAM_CALLS.labels(PRIORITY_NAMES[priority], "rejected").inc()
+            raise UpstreamBusy(self.retry_after())
+        except BaseException:
+            self._abandon(waiter)
+            raise
+        UPSTREAM_WAIT_SECONDS.labels(PRIORITY_NAMES[priority]).observe(time.perf_counter() - start)
+        UPSTREAM_CALLS.labels(PRIORITY_NAMES[priority], "admitted").inc()
+
+    async def _admitted(self, call, user: Optional[str], priority: int):
+        await self.acquire(priority, user)
+        start = time.monotonic()
+        try:
+            return await call()
+        finally:
+            self._release(priority, user, time.monotonic() - start)
+
+    def _land(self, key: str, flight: asyncio.Future):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        # Every caller may have gone; mark the outcome as seen either way
+        if not flight.cancelled():
+            flight.exception()
+
+    async def run(self, call, user: Optional[str], priority: int = INTERACTIVE, key: Optional[str] = None):
+        """Await `call()`, a coroutine function, once admitted.
+
+        Concurrent calls with the same `key` share the first one's admission and result.
+        """
+        if self._loop is None:
+            return await call()
+        if key is None:
+            return await self._admitted(call, user, priority)
+
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = asyncio.ensure_future(self._admitted(call, user, priority))
+            self._flights[key] = flight
+            flight.add_done_callback(partial(self._land, key))
+        else:
+            self.coalesced += 1
+            UPSTREAM_CALLS.labels(PRIORITY_NAMES[priority], "coalesced").inc()
+        # A caller that goes away does not cancel the call others are waiting on
+        return await asyncio.shield(flight)
+
+    @asynccontextmanager
+    async def slot(self, user: Optional[str], priority: int = INTERACTIVE):
+        """Hold one admission for the duration of the block, as for a streamed answer."""
+        await self.acquire(priority, user)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            if self._loop is not None:
+                self._release(priority, user, time.monotonic() - start)
+
+    def call_threadsafe(self, func, *args, user: Optional[str] = None, priority: int = BULK):
+        """Run blocking `func` on the calling worker thread once the loop admits it."""
+        loop = self._loop
+        if loop is None or _running_loop() is loop:
+            return func(*args)
+        asyncio.run_coroutine_threadsafe(self.acquire(priority, user), loop).result()
+        start = time.monotonic()
+        try:
+            return func(*args)
+        finally:
+            try:
+                loop.call_soon_threadsafe(self._release, priority, user, time.monotonic() - start)
+            except RuntimeError:
+                # The loop has shut down
+                pass
+
+    def stats(self) -> dict:
+        return {
+            "running": self._running,
+            "running_bulk": self._running_bulk,
+            "waiting": len(self._waiting),
+            "waiting_interactive": sum(1 for waiter in self._waiting if waiter.priority == INTERACTIVE),
+            "in_flight_keys": len(self._flights),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "coalesced": self.coalesced,
+            "tokens": round(self.bucket.tokens, 2) if self.bucket.rate > 0 else None,
+            "service_seconds": round(self._service_seconds, 3),
+        }
+
+
+def _running_loop():
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+upstream_scheduler = UpstreamScheduler(
+    max_concurrency=settings.UPSTREAM_MAX_CONCURRENCY,
+    user_concurrency=settings.UPSTREAM_USER_CONCURRENCY,
+    bulk_concurrency=settings.UPSTREAM_BULK_CONCURRENCY,
+    rate=settings.UPSTREAM_RATE,
+    burst=settings.UPSTREAM_BURST,
+    max_queue=settings.UPSTREAM_MAX_QUEUE,
+    queue_timeout=settings.UPSTREAM_QUEUE_TIMEOUT,
+)
@@ -0,0 +1,316 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+from typing import List, Optional
+
+import numpy as np
+from langchain_core.documents import Document
+
+from app.config import settings
+from app.services.embedding_service import get_embeddings
+from app.services.bm25_index import BM25Index
+from app.services.faiss_index import build_index, tune_index, apply_search_parameters
+from app.services.metrics_service import timed
+
+# faiss and LangChain's FAISS store are imported where they are used: they are
+# slow to import, and a worker needs them only once it builds or loads an index
+INDEX_FILE = "index.faiss"
+DOCSTORE_FILE = "docstore.json"
+BM25_FILE = "bm25.json"
+MANIFEST_FILE = "manifest.json"
+VECTORS_FILE = "vectors.npy"
+
+
+def index_dir(index_key: str) -> str:
+    # Fan out on the first two hex characters so no single directory gets huge
+    return os.path.join(settings.VECTOR_STORE_DIR, index_key[:2], index_key)
+
+
+def index_exists(index_key: str) -> bool:
+    return os.path.isfile(os.path.join(index_dir(index_key), INDEX_FILE))
+
+
+def build_knowledge_base(documents: List[Document]):
+    """Embed `documents` into a FAISS knowledge base, returning it with its build manifest and vectors.
+
+    The index type depends on the number of chunks; see faiss_index.build_index.
+    """
+    from langchain_community.vectorstores import FAISS
+    from langchain_community.docstore.in_memory import InMemoryDocstore
+    embeddings = get_embeddings()
+    with timed("upload", "embed"):
+        vectors = np.asarray(embeddings.embed_documents([document.page_content for document in documents]), dtype=np.float32)
+    with timed("upload", "index"):
+        index, manifest = build_index(vectors)
+
+    ids = docstore_ids(documents)
+    knowledge_base = FAISS(
+        embedding_function=embeddings,
+        index=index,
+        docstore=InMemoryDocstore(dict(zip(ids, documents))),
+        index_to_docstore_id=dict(enumerate(ids))
+    )
+    return knowledge_base, manifest, vectors
+
+
+def chunk_hash(document: Document) -> str:
+    return hashlib.sha256(document.page_content.encode("utf-8")).hexdigest()
+
+
+def docstore_ids(documents: List[Document]) -> List[str]:
+    # Derived from position and text, so identical chunks always serialize to the
+    # same docstore bytes and therefore the same index_key
+    return [f"{position}-{chunk_hash(document)[:16]}" for position, document in enumerate(documents)]
+
+
+def patch_knowledge_base(index_key: str, documents: List[Document]):
+    """Build the knowledge base for a revised document from the stored one at index_key.
+
+    Chunks are matched by content hash. Unchanged chunks keep their exact
+    vectors (only their page metadata is refreshed), only new chunks are
+    embedded, and the index is refilled in place on its already-trained
+    structure, so IVF centroids and quantizers are not retrained. Returns the
+    knowledge base, its manifest, its vectors and counts of reused, embedded
+    and removed chunks. The patched index is re-tuned and re-measured like a
+    new build. The stored index is never modified; the caller saves the
+    result under its new key.
+    """
+    import faiss
+    from langchain_community.vectorstores import FAISS
+    from langchain_community.docstore.in_memory import InMemoryDocstore
+    path = index_dir(index_key)
+    # A private, writable copy; other PDFs may share the stored one
+    index = faiss.read_index(os.path.join(path, INDEX_FILE))
+    with open(os.path.join(path, DOCSTORE_FILE), "rb") as f:
+        stored = json.load(f)
+    stored_ids = stored["index_to_docstore_id"]
+
+    old_positions = {}
+    for position, doc_id in enumerate(stored_ids):
+        content = stored["documents"][doc_id]["page_content"]
+        old_positions.setdefault(chunk_hash(Document(page_content=content)), []).append(position)
+
+    reused, added = [], []
+    for document in documents:
+        positions = old_positions.get(chunk_hash(document))
+        if positions:
+            reused.append((document, positions.pop(0)))
+        else:
+            added.append(document)
+
+    kept_vectors = None
+    if reused:
+        # Compressed indexes only hold approximations, which would drift further with every revision
+        kept_vectors = load_vectors(index_key, index)[[position for _, position in reused]]
+    new_vectors = None
+    if added:
+        with timed("revision", "embed"):
+            new_vectors = np.asarray(
+                get_embeddings().embed_documents([document.page_content for document in added]),
+                dtype=np.float32
+            )
+
+    # Unchanged chunks go back first in their new order, followed by the new ones.
+    # HNSW cannot remove vectors, so its graph is rebuilt from them
+    index.reset()
+    vectors = np.concatenate([part for part in (kept_vectors, new_vectors) if part is not None])
+    index.add(vectors)
+
+    ordered = [document for document, _ in reused] + added
+    ids = docstore_ids(ordered)
+    knowledge_base = FAISS(
+        embedding_function=get_embeddings(),
+        index=index,
+        docstore=InMemoryDocstore(dict(zip(ids, ordered))),
+        index_to_docstore_id=dict(enumerate(ids))
+    )
+
+    # The structure is the parent's, but recall, speed and search parameters are the patched index's own
+    with timed("revision", "index"):
+        manifest = {
+            "index_factory": load_manifest(index_key).get("index_factory"),
+            **tune_index(index, vectors),
+            "revision_of": index_key,
+        }
+    stats = {
+        "reused_chunks": len(reused),
+        "embedded_chunks": len(added),
+        "removed_chunks": len(stored_ids) - len(reused),
+        "changed_pages": sorted({document.metadata.get("page") for document in added}, key=str),
+    }
+    return knowledge_base, manifest, vectors, stats
+
+
+def save_knowledge_base(knowledge_base, manifest: Optional[dict] = None, vectors: Optional[np.ndarray] = None) -> str:
+    """Write a FAISS knowledge base to the content-addressed store and return its key.
+
+    The raw index is written in FAISS' native format so it can be mmapped on
+    load, and the docstore is written as plain JSON instead of a pickle. The
+    BM25 index, the build manifest and, for compressed indexes, the exact
+    `vectors` are derived data, so they do not change the key.
+    """
+    import faiss
+    index_bytes = faiss.serialize_index(knowledge_base.index).tobytes()
+
+    ids = [knowledge_base.index_to_docstore_id[i] for i in range(len(knowledge_base.index_to_docstore_id))]
+    documents = {}
+    for doc_id in ids:
+        document = knowledge_base.docstore.search(doc_id)
+        documents[doc_id] = {"page_content": document.page_content, "metadata": document.metadata}
+    docstore_bytes = json.dumps(
+        {"index_to_docstore_id": ids, "documents": documents},
+        sort_keys=True
+    ).encode("utf-8")
+
+    digest = hashlib.sha256()
+    digest.update(index_bytes)
+    digest.update(docstore_bytes)
+    index_key = digest.hexdigest()
+
+    if index_exists(index_key):
+        return index_key
+
+    target = index_dir(index_key)
+    parent = os.path.dirname(target)
+    os.makedirs(parent, exist_ok=True)
+
+    # Write into a scratch directory first so readers never see a partial index
+    tmp_dir = tempfile.mkdtemp(prefix=".tmp-", dir=parent)
+    try:
+        with open(os.path.join(tmp_dir, INDEX_FILE), "wb") as f:
+            f.write(index_bytes)
+        with open(os.path.join(tmp_dir, DOCSTORE_FILE), "wb") as f:
+            f.write(docstore_bytes)
+        bm25 = BM25Index.from_texts([documents[doc_id]["page_content"] for doc_id in ids])
+        with open(os.path.join(tmp_dir, BM25_FILE), "w") as f:
+            json.dump(bm25.to_dict(), f, separators=(",", ":"))
+        if manifest is not None:
+            with open(os.path.join(tmp_dir, MANIFEST_FILE), "w") as f:
+                json.dump(manifest, f, indent=2)
+        if vectors is not None and not isinstance(knowledge_base.index, faiss.IndexFlat):
+            np.save(os.path.join(tmp_dir, VECTORS_FILE), np.asarray(vectors, dtype=np.float32))
+        os.rename(tmp_dir, target)
+    except OSError:
+        # Another worker stored the same content first
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        if not index_exists(index_key):
+            raise
+
+    return index_key
+
+
+def read_stored_index(index_key: str):
+    import faiss
+    path = os.path.join(index_dir(index_key), INDEX_FILE)
+    try:
+        return faiss.read_index(path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+    except RuntimeError:
+        # Not every index type or filesystem supports mmap; fall back to reading it into memory
+        return faiss.read_index(path)
+
+
+def load_vectors(index_key: str, index=None) -> np.ndarray:
+    """The exact vectors of a stored knowledge base, in index order.
+
+    A flat index holds them itself and compressed indexes keep them next to
+    the index. Compressed indexes stored without them re-embed their chunk
+    text through the embedding cache, so callers run this as bulk work.
+    """
+    import faiss
+    index = index if index is not None else read_stored_index(index_key)
+    if isinstance(index, faiss.IndexFlat):
+        return index.reconstruct_n(0, index.ntotal)
+    vectors_path = os.path.join(index_dir(index_key), VECTORS_FILE)
+    if os.path.isfile(vectors_path):
+        return np.load(vectors_path, mmap_mode="r")
+    with open(os.path.join(index_dir(index_key), DOCSTORE_FILE), "rb") as f:
+        stored = json.load(f)
+    texts = [stored["documents"][doc_id]["page_content"] for doc_id in stored["index_to_docstore_id"]]
+    return np.asarray(get_embeddings().embed_documents(texts), dtype=np.float32)
+
+
+def load_knowledge_base(index_key: str):
+    """Open a stored knowledge base, returning it with its private memory size in bytes.
+
+    The FAISS index is mmapped read-only, so its pages live in the shared page
+    cache rather than in each worker's heap; only the docstore is counted.
+    """
+    from langchain_community.vectorstores import FAISS
+    from langchain_community.docstore.in_memory import InMemoryDocstore
+    path = index_dir(index_key)
+    index = read_stored_index(index_key)
+    apply_search_parameters(index, load_manifest(index_key))
+
+    docstore_path = os.path.join(path, DOCSTORE_FILE)
+    with open(docstore_path, "rb") as f:
+        data = json.load(f)
+
+    docstore = InMemoryDocstore({
+        doc_id: Document(page_content=doc["page_content"], metadata=doc["metadata"])
+        for doc_id, doc in data["documents"].items()
+    })
+    knowledge_base = FAISS(
+        embedding_function=get_embeddings(),
+        index=index,
+        docstore=docstore,
+        index_to_docstore_id=dict(enumerate(data["index_to_docstore_id"]))
+    )
+    ensure_page_metadata(knowledge_base)
+    return knowledge_base, os.path.getsize(docstore_path)
+
+
+def load_manifest(index_key: str) -> dict:
+    # Indexes stored before manifests existed are flat, with nothing to tune
+    try:
+        with open(os.path.join(index_dir(index_key), MANIFEST_FILE)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def load_bm25_index(index_key: str, knowledge_base):
+    """Open a stored knowledge base's BM25 index, returning it with its file size in bytes.
+
+    Indexes stored before BM25 existed get one built from their docstore.
+    """
+    bm25_path = os.path.join(index_dir(index_key), BM25_FILE)
+    if not os.path.isfile(bm25_path):
+        return BM25Index.from_knowledge_base(knowledge_base), 0
+    with open(bm25_path, "rb") as f:
+        return BM25Index.from_dict(json.load(f)), os.path.getsize(bm25_path)
+
+
+def ensure_page_metadata(knowledge_base):
+    # Knowledge bases built before chunks carried page numbers still have to
+    # render through the page-aware document prompt
+    for document in knowledge_base.docstore._dict.values():
+        document.metadata.setdefault("page", "unknown")
+
+
+def retire_knowledge_base(index_key: str) -> Optional[str]:
+    """Move a stored knowledge base out of its key's place, returning where it went.
+
+    Called while its knowledge_bases row is locked, so index_exists is already
+    False for anyone who locks the row next; the files are only deleted with
+    delete_retired once the transaction that freed them has committed.
+    """
+    target = index_dir(index_key)
+    retired = tempfile.mkdtemp(prefix=".retired-", dir=os.path.dirname(target))
+    try:
+        os.rename(target, os.path.join(retired, index_key))
+    except FileNotFoundError:
+        os.rmdir(retired)
+        return None
+    return retired
+
+
+def restore_knowledge_base(index_key: str, retired: str):
+    # The freeing transaction failed, so the PDFs it would have released still point here
+    os.rename(os.path.join(retired, index_key), index_dir(index_key))
+    os.rmdir(retired)
+
+
+def delete_retired(retired: str):
+    shutil.rmtree(retired, ignore_errors=True)
@@ -1,16 +1,35 @@
-from typing import List, Optional, Dict, Any
-from pydantic import BaseModel
+from typing import List, Optional, Dict, Any, Union, Literal
+from pydantic import BaseModel, Field, model_validator
 from datetime import datetime
 
 class Question(BaseModel):
     question: str
-    pdf_id: str
+    pdf_id: Optional[str] = None
+    # Ask across several documents at once: a list of PDF ids, or "all" for the whole library
+    pdf_ids: Optional[Union[Literal["all"], List[str]]] = None
+    # Number of chunks to answer from; defaults to RETRIEVAL_K
+    k: Optional[int] = Field(default=None, ge=1, le=20)
+    # Treat the question as a follow-up: rewrite it into a standalone question from the conversation so far
+    conversational: bool = False
+    
+    @model_validator(mode="after")
+    def check_target(self):
+        if (self.pdf_id is None) == (self.pdf_ids is None):
+            raise ValueError("Provide exactly one of pdf_id or pdf_ids")
+        if isinstance(self.pdf_ids, list) and not self.pdf_ids:
+            raise ValueError("pdf_ids cannot be empty")
+        return self
 
 class ChatMessage(BaseModel):
     user: str
     ai: str
     timestamp: str
 
+class SourceResponse(BaseModel):
+    pdf_id: str
+    name: str
+    page: Any
+
 class ConversationResponse(BaseModel):
     id: str
     pdf_id: str
@@ -18,4 +37,15 @@ class ConversationResponse(BaseModel):
     created_at: datetime
     
     class Config:
-        orm_mode = True
\ No newline at end of file
+        orm_mode = True
+
+class ChatMessageResponse(BaseModel):
+    id: str
+    question: str
+    answer: str
+    created_at: datetime
+
+class ChatMessagePage(BaseModel):
+    conversation_id: str
+    messages: List[ChatMessageResponse]
+    next_cursor: Optional[str] = None
@@ -1,3 +1,4 @@
+from typing import List, Optional
 from pydantic import BaseModel
 from datetime import datetime
 
@@ -8,6 +9,17 @@ class PDFResponse(PDFBase):
     id: str
     size: str  
     uploaded_date: datetime
+    status: str
     
     class Config:
-        orm_mode = True
\ No newline at end of file
+        orm_mode = True
+
+class PDFListResponse(BaseModel):
+    items: List[PDFResponse]
+    next_cursor: Optional[str] = None
+
+
+class PDFStatusResponse(BaseModel):
+    id: str
+    status: str
+    error: Optional[str] = None
@@ -0,0 +1,95 @@
+"""SQL statements per request for each authenticated endpoint.
+
+Counts the statements both database engines execute while serving each
+endpoint, with the principal cache disabled and then enabled, against a
+throwaway SQLite database with fake embeddings and a fake LLM:
+
+    python -m benchmarks.auth_queries --requests 20
+"""
+import os
+import sys
+import json
+import asyncio
+import argparse
+import tempfile
+
+from benchmarks.chat_load import configure_environment, prepare
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, *args, **kwargs):
+        self.count += 1
+
+
+def endpoints(pdf_id: str):
+    return [
+        ("GET /auth/me", "GET", "/api/v1/auth/me", None),
+        ("GET /pdf/pdfs", "GET", "/api/v1/pdf/pdfs", None),
+        ("GET /pdf/{id}/status", "GET", f"/api/v1/pdf/{pdf_id}/status", None),
+        ("POST /chat/", "POST", "/api/v1/chat/", {"question": "What does section 1.1 say?", "pdf_id": pdf_id}),
+        ("GET /chat/conversations/{id}/messages", "GET", f"/api/v1/chat/conversations/{pdf_id}/messages", None),
+    ]
+
+
+async def measure(client, counter: QueryCounter, pdf_id: str, requests: int):
+    results = {}
+    for name, method, path, body in endpoints(pdf_id):
+        # One warm-up request fills the caches the steady state runs with
+        (await client.request(method, path, json=body)).raise_for_status()
+        counter.count = 0
+        for _ in range(requests):
+            (await client.request(method, path, json=body)).raise_for_status()
+        results[name] = round(counter.count / requests, 2)
+    return results
+
+
+async def main(args):
+    import httpx
+    from sqlalchemy import event
+    import main as app_main
+    from app.db import engine, async_engine
+    from app.services.principal_cache import principal_cache
+    from app.migrate import upgrade_schema
+
+    upgrade_schema()
+
+    counter = QueryCounter()
+    event.listen(engine, "before_cursor_execute", counter)
+    event.listen(async_engine.sync_engine, "before_cursor_execute", counter)
+
+    transport = httpx.ASGITransport(app=app_main.app)
+    try:
+        async with app_main.app.router.lifespan_context(app_main.app):
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+                pdf_id = await prepare(client, args.pages)
+
+                ttl = principal_cache.ttl
+                principal_cache.ttl = 0
+                principal_cache.clear()
+                uncached = await measure(client, counter, pdf_id, args.requests)
+
+                principal_cache.ttl = ttl or 30
+                cached = await measure(client, counter, pdf_id, args.requests)
+    finally:
+        await async_engine.dispose()
+
+    return {
+        name: {"queries_without_cache": uncached[name], "queries_with_cache": cached[name]}
+        for name in uncached
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=20, help="Requests per endpoint")
+    parser.add_argument("--pages", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        configure_environment(workdir, 0.0)
+        sys.path.insert(0, os.getcwd())
+        result = asyncio.run(main(args))
+    print(json.dumps(result, indent=2))
@@ -0,0 +1,96 @@
+"""Requests/second for POST /auth/register and POST /auth/login under concurrency.
+
+Registers `--requests` users and then logs each of them in, with `--concurrency`
+clients in flight, against a throwaway SQLite database. Alongside throughput
+it reports the event loop's worst stall, which stays near zero while bcrypt
+runs on the password executor:
+
+    python -m benchmarks.auth_throughput --concurrency 20 --requests 200 --rounds 12
+"""
+import os
+import sys
+import time
+import json
+import asyncio
+import argparse
+import tempfile
+import statistics
+
+from benchmarks.chat_load import configure_environment
+
+
+async def loop_lag_probe(samples: list, interval: float = 0.005):
+    # How late a short sleep wakes up is how long something else held the loop
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(time.perf_counter() - start - interval)
+
+
+async def run_phase(client, path: str, bodies: list, concurrency: int):
+    latencies = []
+    errors = 0
+    remaining = iter(bodies)
+    lag = []
+
+    async def worker():
+        nonlocal errors
+        for body in remaining:
+            start = time.perf_counter()
+            response = await client.post(path, json=body)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                errors += 1
+
+    probe = asyncio.create_task(loop_lag_probe(lag))
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    probe.cancel()
+
+    latencies.sort()
+    return {
+        "requests": len(bodies),
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "requests_per_s": round(len(bodies) / elapsed, 2),
+        "p50_ms": round(statistics.median(latencies) * 1000, 1),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 1),
+        "max_loop_lag_ms": round(max(lag, default=0) * 1000, 1),
+    }
+
+
+async def main(args):
+    import httpx
+    import main as app_main
+    from app import db
+    from app.migrate import upgrade_schema
+
+    upgrade_schema()
+
+    users = [{"email": f"user{i}@example.com", "password": f"password-{i}"} for i in range(args.requests)]
+    transport = httpx.ASGITransport(app=app_main.app)
+    try:
+        async with app_main.app.router.lifespan_context(app_main.app):
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+                register = await run_phase(client, "/api/v1/auth/register", users, args.concurrency)
+                login = await run_phase(client, "/api/v1/auth/login", users, args.concurrency)
+    finally:
+        await db.async_engine.dispose()
+
+    return {"concurrency": args.concurrency, "bcrypt_rounds": args.rounds, "register": register, "login": login}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--rounds", type=int, default=12, help="BCRYPT_ROUNDS")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        configure_environment(workdir, 0.0)
+        os.environ["BCRYPT_ROUNDS"] = str(args.rounds)
+        sys.path.insert(0, os.getcwd())
+        result = asyncio.run(main(args))
+    print(json.dumps(result, indent=2))
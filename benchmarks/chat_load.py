@@ -0,0 +1,128 @@
+"""Requests/second for POST /chat/ at a fixed number of concurrent clients.
+
+Runs the app in-process over ASGI against a throwaway SQLite database, with
+deterministic fake embeddings and a fake LLM whose latency stands in for the
+OpenAI call. Run it on two checkouts to compare them:
+
+    python -m benchmarks.chat_load --concurrency 50 --requests 500 --llm-latency 0.2
+"""
+import os
+import sys
+import time
+import json
+import asyncio
+import argparse
+import tempfile
+import statistics
+
+
+def configure_environment(workdir: str, llm_latency: float):
+    os.environ.update(
+        DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        VECTOR_STORE_DIR=os.path.join(workdir, "indexes"),
+        UPLOAD_SPOOL_DIR=os.path.join(workdir, "uploads"),
+        EMBEDDING_CACHE_PATH=os.path.join(workdir, "embeddings.sqlite3"),
+        EMBEDDING_PROVIDER="fake",
+        LLM_PROVIDER="fake",
+        FAKE_LLM_LATENCY=str(llm_latency),
+        OPENAI_API_KEY=os.environ.get("OPENAI_API_KEY", "benchmark"),
+    )
+
+
+async def prepare(client, pages: int):
+    from app.db import SessionLocal
+    from app.models.user_model import User
+    from app.services.auth_service import get_password_hash
+    from benchmarks.synthetic_pdf import synthetic_pdf
+
+    db = SessionLocal()
+    db.add(User(email="bench@example.com", hashed_password=get_password_hash("bench")))
+    db.commit()
+    db.close()
+
+    response = await client.post("/api/v1/auth/login", json={"email": "bench@example.com", "password": "bench"})
+    response.raise_for_status()
+
+    response = await client.post(
+        "/api/v1/pdf/upload",
+        files={"file": ("bench.pdf", synthetic_pdf(pages), "application/pdf")}
+    )
+    response.raise_for_status()
+    pdf_id = response.json()["id"]
+
+    while True:
+        status = (await client.get(f"/api/v1/pdf/{pdf_id}/status")).json()["status"]
+        if status == "ready":
+            return pdf_id
+        if status == "failed":
+            raise RuntimeError("Benchmark PDF failed to ingest")
+        await asyncio.sleep(0.05)
+
+
+async def run_load(client, pdf_id: str, concurrency: int, total: int):
+    latencies = []
+    errors = 0
+    remaining = iter(range(total))
+
+    async def worker():
+        nonlocal errors
+        for i in remaining:
+            start = time.perf_counter()
+            response = await client.post("/api/v1/chat/", json={"question": f"What does section {i % 20 + 1}.1 say?", "pdf_id": pdf_id})
+            latencies.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "requests": total,
+        "concurrency": concurrency,
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "requests_per_s": round(total / elapsed, 2),
+        "p50_ms": round(statistics.median(latencies) * 1000, 1),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 1),
+    }
+
+
+async def main(args):
+    import httpx
+    import main as app_main
+    from app.migrate import upgrade_schema
+
+    # Tables come from the migration step, not from importing the app
+    upgrade_schema()
+
+    transport = httpx.ASGITransport(app=app_main.app)
+    try:
+        # ASGITransport does not send lifespan events, so run startup and shutdown here
+        async with app_main.app.router.lifespan_context(app_main.app):
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+                pdf_id = await prepare(client, args.pages)
+                # Warm the knowledge-base cache so the run measures steady state
+                await run_load(client, pdf_id, 1, 3)
+                return await run_load(client, pdf_id, args.concurrency, args.requests)
+    finally:
+        # Older checkouts have no async engine to close
+        from app import db
+        if hasattr(db, "async_engine"):
+            await db.async_engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="Seconds per fake LLM call")
+    parser.add_argument("--pages", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        configure_environment(workdir, args.llm_latency)
+        sys.path.insert(0, os.getcwd())
+        result = asyncio.run(main(args))
+    print(json.dumps(result, indent=2))
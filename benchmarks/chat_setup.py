@@ -0,0 +1,59 @@
+"""Per-request setup cost of the chat path, outside the model call.
+
+Compares building the OpenAI client, prompt and chain for every question (the
+old behaviour) with binding a request to the shared LLMRegistry chain. No
+network calls are made; the OpenAI client is only constructed.
+
+    python -m benchmarks.chat_setup --iterations 2000
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+
+
+def measure(func, iterations: int) -> dict:
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return {
+        "p50_us": round(statistics.median(timings) * 1e6, 1),
+        "p95_us": round(timings[int(len(timings) * 0.95) - 1] * 1e6, 1),
+    }
+
+
+def main(args):
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+    os.environ.setdefault("DATABASE_URL", "sqlite://")
+    os.environ["LLM_PROVIDER"] = "openai"
+    sys.path.insert(0, os.getcwd())
+
+    from langchain_core.prompts import PromptTemplate
+    from langchain_community.llms.openai import OpenAI
+    from app.services.chat_service import PROMPT_TEMPLATE
+    from app.services.llm_service import LLMRegistry
+
+    def per_request():
+        prompt = PromptTemplate(input_variables=["context", "question"], template=PROMPT_TEMPLATE.template)
+        return prompt | OpenAI(model="gpt-3.5-turbo-instruct")
+
+    registry = LLMRegistry()
+
+    def shared():
+        return registry.qa_chain
+
+    return {
+        "per_request_construction": measure(per_request, args.iterations),
+        "registry": measure(shared, args.iterations),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=2000)
+    print(json.dumps(main(parser.parse_args()), indent=2))
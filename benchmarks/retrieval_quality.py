@@ -0,0 +1,75 @@
+"""Exact-term retrieval hit rate: dense-only FAISS search vs hybrid FAISS + BM25.
+
+Every synthetic page carries a unique "Section N.1 reference SKU-0000N" line.
+For a sample of pages this asks for the section or the SKU and counts how often
+a chunk from the right page is among the k retrieved. Uses deterministic fake
+embeddings unless EMBEDDING_PROVIDER is set.
+
+    python -m benchmarks.retrieval_quality --pages 200 --k 4
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import statistics
+
+
+def main(args, workdir):
+    os.environ.setdefault("EMBEDDING_PROVIDER", "fake")
+    os.environ.setdefault("DATABASE_URL", "sqlite://")
+    os.environ.update(
+        VECTOR_STORE_DIR=os.path.join(workdir, "indexes"),
+        EMBEDDING_CACHE_PATH=os.path.join(workdir, "embeddings.sqlite3"),
+    )
+    sys.path.insert(0, os.getcwd())
+
+    from langchain.text_splitter import CharacterTextSplitter
+    from langchain_community.vectorstores import FAISS
+    from app.services.embedding_service import get_embeddings
+    from app.services.vector_store import save_knowledge_base
+    from app.services.kb_cache import open_knowledge_base
+    from benchmarks.synthetic_pdf import page_text
+
+    splitter = CharacterTextSplitter(separator="\n", chunk_size=2000, chunk_overlap=200, length_function=len)
+    chunks = []
+    for page_number in range(1, args.pages + 1):
+        chunks.extend(splitter.create_documents([page_text(page_number)], metadatas=[{"page": page_number}]))
+    retriever, _ = open_knowledge_base(save_knowledge_base(FAISS.from_documents(chunks, get_embeddings())))
+
+    rng = random.Random(0)
+    sample = rng.sample(range(1, args.pages + 1), min(args.queries, args.pages))
+    questions = [(f"What does section {n}.1 say?", n) for n in sample] + [(f"Which page lists SKU-{n:05d}?", n) for n in sample]
+
+    results = {}
+    for mode in ("dense", "hybrid"):
+        hits, timings, context_chars = 0, [], []
+        for question, page in questions:
+            vector = get_embeddings().embed_query(question)
+            start = time.perf_counter()
+            if mode == "dense":
+                documents = retriever.vector_store.similarity_search_by_vector(vector, k=args.k)
+            else:
+                documents = retriever.search(question, vector, args.k)
+            timings.append(time.perf_counter() - start)
+            hits += any(document.metadata["page"] == page for document in documents)
+            context_chars.append(sum(len(document.page_content) for document in documents))
+        results[mode] = {
+            "hit_rate": round(hits / len(questions), 3),
+            "p50_ms": round(statistics.median(timings) * 1000, 3),
+            "mean_context_chars": round(statistics.mean(context_chars)),
+        }
+    return {"pages": args.pages, "chunks": len(chunks), "k": args.k, "queries": len(questions), **results}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--queries", type=int, default=100, help="Pages to sample; two questions each")
+    parser.add_argument("--k", type=int, default=4)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        print(json.dumps(main(args, workdir), indent=2))
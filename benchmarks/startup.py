@@ -0,0 +1,214 @@
+"""Worker cold-start time and database connections per worker.
+
+Sets up the schema once with `python -m app.migrate`, as a deploy would, then
+starts workers the way a server does and times each one:
+- import_s: importing the app
+- lifespan_s: running its startup
+- ready_s: from process start (or fork) until GET /ready first answers 200
+
+A fresh interpreter per worker is the plain `uvicorn --workers` case. With
+`--preload`, the app and its heavy libraries are imported once and workers
+are forked from that process, the gunicorn.conf.py case.
+
+Each worker then serves a burst of `--burst` concurrent authenticated
+requests. The report gives the database connections it opened, the most it
+held open at once, and the pool limit from Settings they must stay within:
+
+    python -m benchmarks.startup --workers 4 --burst 50
+    python -m benchmarks.startup --workers 4 --preload --database-url postgresql://...
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import subprocess
+
+from benchmarks.chat_load import configure_environment
+
+
+class ConnectionCount:
+    opened = 0
+    open = 0
+    peak = 0
+
+
+def count_connections(engine):
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "connect")
+    def connected(dbapi_connection, connection_record):
+        ConnectionCount.opened += 1
+        ConnectionCount.open += 1
+        ConnectionCount.peak = max(ConnectionCount.peak, ConnectionCount.open)
+
+    @event.listens_for(engine, "close")
+    def closed(dbapi_connection, connection_record):
+        ConnectionCount.open -= 1
+
+
+async def serve(app, burst: int) -> dict:
+    import httpx
+
+    timings = {}
+    transport = httpx.ASGITransport(app=app)
+    start = time.perf_counter()
+    async with app.router.lifespan_context(app):
+        timings["lifespan_s"] = time.perf_counter() - start
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            while (await client.get("/ready")).status_code != 200:
+                await asyncio.sleep(0.01)
+            timings["first_ready_s"] = time.perf_counter() - start
+            ready_at = time.time()
+
+            credentials = {"email": f"startup-{os.getpid()}@example.com", "password": "startup-password"}
+            (await client.post("/api/v1/auth/register", json=credentials)).raise_for_status()
+            (await client.post("/api/v1/auth/login", json=credentials)).raise_for_status()
+            paths = ["/api/v1/pdf/pdfs", "/api/v1/auth/me"]
+            responses = await asyncio.gather(*(client.get(paths[i % len(paths)]) for i in range(burst)))
+            errors = sum(1 for response in responses if response.status_code >= 400)
+            open_after_burst = ConnectionCount.open
+    return {
+        **timings,
+        "ready_at": ready_at,
+        "burst_errors": errors,
+        "connections_opened": ConnectionCount.opened,
+        "connections_peak": ConnectionCount.peak,
+        "connections_open_after_burst": open_after_burst,
+    }
+
+
+def run_worker(burst: int) -> dict:
+    """One fresh worker process: import the app, start it and serve a burst."""
+    start = time.perf_counter()
+    import main
+    from app import db
+    import_s = time.perf_counter() - start
+
+    count_connections(db.engine)
+    count_connections(db.async_engine.sync_engine)
+    return {"import_s": import_s, **asyncio.run(serve(main.app, burst))}
+
+
+def spawn_workers(count: int, burst: int) -> list:
+    results = []
+    for _ in range(count):
+        started_at = time.time()
+        output = subprocess.run(
+            [sys.executable, "-m", "benchmarks.startup", "--worker", "--burst", str(burst)],
+            capture_output=True, text=True, check=True
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        result["ready_s"] = result.pop("ready_at") - started_at
+        results.append(result)
+    return results
+
+
+def fork_workers(count: int, burst: int) -> tuple:
+    """Import once, then fork workers from the loaded process as a preloading server does."""
+    start = time.perf_counter()
+    import main
+    from app import db
+    from app.preload import preload_libraries
+    preload_libraries()
+    preload_s = time.perf_counter() - start
+
+    results = []
+    for _ in range(count):
+        read_end, write_end = os.pipe()
+        forked_at = time.time()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_end)
+            # What gunicorn.conf.py's post_fork does
+            db.engine.dispose(close=False)
+            db.async_engine.sync_engine.dispose(close=False)
+            count_connections(db.engine)
+            count_connections(db.async_engine.sync_engine)
+            with os.fdopen(write_end, "w") as f:
+                json.dump({"import_s": 0.0, **asyncio.run(serve(main.app, burst))}, f)
+            os._exit(0)
+        os.close(write_end)
+        with os.fdopen(read_end) as f:
+            result = json.loads(f.read())
+        os.waitpid(pid, 0)
+        result["ready_s"] = result.pop("ready_at") - forked_at
+        results.append(result)
+    return results, preload_s
+
+
+def summarize(results: list) -> dict:
+    keys = ("import_s", "lifespan_s", "first_ready_s", "ready_s")
+    summary = {f"mean_{key}": round(sum(result[key] for result in results) / len(results), 4) for key in keys}
+    summary["max_ready_s"] = round(max(result["ready_s"] for result in results), 4)
+    summary.update({
+        "max_connections_peak": max(result["connections_peak"] for result in results),
+        "max_connections_open_after_burst": max(result["connections_open_after_burst"] for result in results),
+        "burst_errors": sum(result["burst_errors"] for result in results),
+    })
+    return summary
+
+
+def main(args) -> dict:
+    with tempfile.TemporaryDirectory() as workdir:
+        configure_environment(workdir, 0.0)
+        # Every burst request goes to the database, and registration stays cheap
+        os.environ.update(AUTH_CACHE_TTL="0", BCRYPT_ROUNDS="4")
+        if args.database_url:
+            os.environ["DATABASE_URL"] = args.database_url
+        sys.path.insert(0, os.getcwd())
+
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-m", "app.migrate"], check=True, capture_output=True)
+        migrate_s = time.perf_counter() - start
+
+        preload_s = None
+        if args.preload:
+            workers, preload_s = fork_workers(args.workers, args.burst)
+        else:
+            workers = spawn_workers(args.workers, args.burst)
+
+        from app.config import settings
+        database = "sqlite" if settings.DATABASE_URL.startswith("sqlite") else settings.DATABASE_URL.split(":", 1)[0]
+
+    # SQLite is left on SQLAlchemy's own pool sizes, so the Settings limit only applies to servers
+    limit = 2 * (settings.DB_POOL_SIZE + settings.DB_MAX_OVERFLOW) if database != "sqlite" else None
+    return {
+        "database": database,
+        "mode": "preload" if args.preload else "spawn",
+        "config": {
+            "workers": args.workers,
+            "burst": args.burst,
+            "db_pool_size": settings.DB_POOL_SIZE,
+            "db_max_overflow": settings.DB_MAX_OVERFLOW,
+        },
+        "migrate_s": round(migrate_s, 4),
+        "preload_s": round(preload_s, 4) if preload_s is not None else None,
+        "connection_limit_per_worker": limit,
+        "connection_limit_all_workers": limit * args.workers if limit is not None else None,
+        "summary": summarize(workers),
+        "workers": [{key: round(value, 4) if isinstance(value, float) else value for key, value in result.items()} for result in workers],
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=4, help="Workers to start, one after another")
+    parser.add_argument("--burst", type=int, default=50, help="Concurrent requests each worker serves once ready")
+    parser.add_argument("--preload", action="store_true", help="Fork workers from a process that imported the app")
+    parser.add_argument("--database-url", help="Run against this database instead of a throwaway SQLite file")
+    parser.add_argument("--output", help="Write the JSON report here as well as printing it")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_worker(args.burst)))
+        sys.exit(0)
+
+    report = main(args)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
@@ -0,0 +1,330 @@
+"""Offline benchmark suite for upload, listing, chat and conversation history.
+
+Runs the app in-process over ASGI with deterministic fake embeddings and a
+fake LLM, against a throwaway SQLite database or `--database-url`. Synthetic
+PDFs of each `--pages` size are uploaded and ingested. Then the list, chat and
+conversation endpoints are driven at `--concurrency`.
+
+Each endpoint reports:
+- p50/p95/p99 latency and throughput
+- peak RSS
+- bytes moved between the app and SQLite: statements and parameters sent,
+  rows fetched
+
+Results are written as JSON so runs can be compared:
+
+    python -m benchmarks.suite --pages 1 100 2000 --output before.json
+    python -m benchmarks.suite --pages 1 100 2000 --output after.json --compare before.json
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import sqlite3
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+
+from benchmarks.chat_load import configure_environment
+from benchmarks.synthetic_pdf import synthetic_pdf
+
+
+class DatabaseTraffic:
+    sent = 0
+    received = 0
+    statements = 0
+
+    @classmethod
+    def reset(cls):
+        cls.sent = cls.received = cls.statements = 0
+
+
+def value_bytes(value) -> int:
+    if value is None:
+        return 0
+    if isinstance(value, str):
+        return len(value.encode("utf-8"))
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return len(value)
+    return 8
+
+
+def rows_bytes(rows) -> int:
+    return sum(value_bytes(value) for row in rows for value in row)
+
+
+class TracingCursor(sqlite3.Cursor):
+    """Counts the statements, parameters and rows that cross the SQLite boundary."""
+
+    def execute(self, sql, parameters=()):
+        DatabaseTraffic.statements += 1
+        DatabaseTraffic.sent += len(sql.encode("utf-8")) + sum(value_bytes(value) for value in _values(parameters))
+        return super().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        seq_of_parameters = list(seq_of_parameters)
+        DatabaseTraffic.statements += 1
+        DatabaseTraffic.sent += len(sql.encode("utf-8")) + sum(
+            value_bytes(value) for parameters in seq_of_parameters for value in _values(parameters)
+        )
+        return super().executemany(sql, seq_of_parameters)
+
+    def fetchone(self):
+        row = super().fetchone()
+        if row is not None:
+            DatabaseTraffic.received += rows_bytes([row])
+        return row
+
+    def fetchmany(self, size=None):
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        DatabaseTraffic.received += rows_bytes(rows)
+        return rows
+
+    def fetchall(self):
+        rows = super().fetchall()
+        DatabaseTraffic.received += rows_bytes(rows)
+        return rows
+
+
+class TracingConnection(sqlite3.Connection):
+    def cursor(self, factory=TracingCursor):
+        return super().cursor(factory)
+
+
+def _values(parameters):
+    return parameters.values() if isinstance(parameters, dict) else parameters
+
+
+def trace_sqlite(engine):
+    # Both the sync and the aiosqlite driver hand connect arguments to sqlite3.connect
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "do_connect")
+    def use_tracing_connection(dialect, connection_record, cargs, cparams):
+        cparams["factory"] = TracingConnection
+
+
+def peak_rss_mb() -> float:
+    # Linux reports kilobytes; extraction subprocesses count as children
+    usage = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return round(usage / 1024, 1)
+
+
+def percentile(ordered: list, fraction: float) -> float:
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def summarize(latencies: list, elapsed: float, errors: int, traced: bool) -> dict:
+    ordered = sorted(latencies)
+    result = {
+        "requests": len(ordered),
+        "errors": errors,
+        "requests_per_s": round(len(ordered) / elapsed, 2) if elapsed else None,
+        "p50_ms": round(percentile(ordered, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(ordered, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(ordered, 0.99) * 1000, 2),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    if traced:
+        result.update({
+            "db_statements_per_request": round(DatabaseTraffic.statements / len(ordered), 2),
+            "db_bytes_sent_per_request": round(DatabaseTraffic.sent / len(ordered)),
+            "db_bytes_received_per_request": round(DatabaseTraffic.received / len(ordered)),
+        })
+    return result
+
+
+async def drive(send, total: int, concurrency: int, traced: bool) -> dict:
+    latencies = []
+    errors = 0
+    remaining = iter(range(total))
+
+    async def worker():
+        nonlocal errors
+        for i in remaining:
+            start = time.perf_counter()
+            response = await send(i)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                errors += 1
+
+    DatabaseTraffic.reset()
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, time.perf_counter() - start, errors, traced)
+
+
+async def wait_until_ready(client, pdf_id: str, database_path: str = None):
+    # On SQLite, poll with a plain connection of our own so the polling does not
+    # count as the upload's database traffic
+    monitor = sqlite3.connect(database_path) if database_path else None
+    try:
+        while True:
+            if monitor is not None:
+                status = monitor.execute("SELECT status FROM pdfs WHERE id = ?", (pdf_id,)).fetchone()[0]
+            else:
+                status = (await client.get(f"/api/v1/pdf/{pdf_id}/status")).json()["status"]
+            if status == "ready":
+                return
+            if status == "failed":
+                raise RuntimeError(f"Benchmark PDF {pdf_id} failed to ingest")
+            await asyncio.sleep(0.02)
+    finally:
+        if monitor is not None:
+            monitor.close()
+
+
+async def upload_phase(client, page_counts: list, repeats: int, traced: bool, database_path: str) -> dict:
+    results = {}
+    pdf_ids = {}
+    for pages in page_counts:
+        latencies, ready_latencies = [], []
+        DatabaseTraffic.reset()
+        start = time.perf_counter()
+        for repeat in range(repeats):
+            # A different seed per repeat, so deduplication never short-cuts ingestion
+            content = synthetic_pdf(pages, seed=repeat)
+            request_start = time.perf_counter()
+            response = await client.post(
+                "/api/v1/pdf/upload", files={"file": (f"bench-{pages}-{repeat}.pdf", content, "application/pdf")}
+            )
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - request_start)
+            pdf_ids[pages] = response.json()["id"]
+            await wait_until_ready(client, pdf_ids[pages], database_path)
+            ready_latencies.append(time.perf_counter() - request_start)
+        result = summarize(latencies, time.perf_counter() - start, 0, traced)
+        ordered = sorted(ready_latencies)
+        result.update({
+            "ready_p50_ms": round(percentile(ordered, 0.50) * 1000, 2),
+            "ready_p95_ms": round(percentile(ordered, 0.95) * 1000, 2),
+            "ready_p99_ms": round(percentile(ordered, 0.99) * 1000, 2),
+        })
+        results[f"{pages}_pages"] = result
+    return results, pdf_ids
+
+
+async def run(args, traced: bool) -> dict:
+    import httpx
+    import main as app_main
+    from app import db
+    from app.migrate import upgrade_schema
+
+    upgrade_schema()
+
+    transport = httpx.ASGITransport(app=app_main.app)
+    results = {}
+    try:
+        async with app_main.app.router.lifespan_context(app_main.app):
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+                credentials = {"email": "bench@example.com", "password": "bench-password"}
+                (await client.post("/api/v1/auth/register", json=credentials)).raise_for_status()
+                (await client.post("/api/v1/auth/login", json=credentials)).raise_for_status()
+
+                database_path = db.engine.url.database if traced else None
+                results["/pdf/upload"], pdf_ids = await upload_phase(
+                    client, args.pages, args.upload_repeats, traced, database_path
+                )
+                pdf_id = pdf_ids[max(args.pages)]
+
+                results["/pdf/pdfs"] = await drive(
+                    lambda i: client.get("/api/v1/pdf/pdfs"), args.requests, args.concurrency, traced
+                )
+                # Distinct questions, so the answer cache does not hide retrieval and the LLM
+                results["/chat/"] = await drive(
+                    lambda i: client.post("/api/v1/chat/", json={
+                        "question": f"What does section {i % max(args.pages) + 1}.1 say? ({i})", "pdf_id": pdf_id
+                    }),
+                    args.requests, args.concurrency, traced
+                )
+                results["/chat/conversations/{pdf_id}"] = await drive(
+                    lambda i: client.get(f"/api/v1/chat/conversations/{pdf_id}"), args.requests, args.concurrency, traced
+                )
+    finally:
+        await db.async_engine.dispose()
+    return results
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current: dict, baseline: dict) -> dict:
+    # Ratios above 1 mean slower (latencies, bytes) or faster (throughput) than the baseline
+    keys = ("p50_ms", "p95_ms", "p99_ms", "requests_per_s", "db_bytes_received_per_request", "ready_p50_ms")
+    changes = {}
+    for endpoint, result in current["results"].items():
+        old = baseline["results"].get(endpoint)
+        if old is None:
+            continue
+        rows = [(endpoint, result, old)] if "p50_ms" in result else [
+            (f"{endpoint} {size}", result[size], old[size]) for size in result if size in old
+        ]
+        for name, new_values, old_values in rows:
+            changes[name] = {
+                key: round(new_values[key] / old_values[key], 3)
+                for key in keys if new_values.get(key) and old_values.get(key)
+            }
+    return changes
+
+
+def main(args):
+    with tempfile.TemporaryDirectory() as workdir:
+        configure_environment(workdir, args.llm_latency)
+        os.environ.setdefault("BCRYPT_ROUNDS", "4")
+        if args.database_url:
+            os.environ["DATABASE_URL"] = args.database_url
+        sys.path.insert(0, os.getcwd())
+
+        # Attach the tracer before anything opens a connection
+        from app import db
+        traced = db.engine.dialect.name == "sqlite"
+        if traced:
+            trace_sqlite(db.engine)
+            trace_sqlite(db.async_engine.sync_engine)
+
+        results = asyncio.run(run(args, traced))
+
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "database": "sqlite" if traced else args.database_url.split(":", 1)[0],
+        "config": {
+            "pages": args.pages,
+            "upload_repeats": args.upload_repeats,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "llm_latency": args.llm_latency,
+        },
+        "results": results,
+    }
+    if args.compare:
+        with open(args.compare) as f:
+            report["compared_to"] = {"file": args.compare, "ratios": compare(report, json.load(f))}
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, nargs="+", default=[1, 100, 2000], help="Synthetic PDF sizes to upload")
+    parser.add_argument("--upload-repeats", type=int, default=3, help="Uploads per size")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="Seconds per fake LLM call")
+    parser.add_argument("--database-url", help="Run against this database instead of a throwaway SQLite file")
+    parser.add_argument("--output", help="Write the JSON report here as well as printing it")
+    parser.add_argument("--compare", help="A previous report to compute ratios against")
+    args = parser.parse_args()
+
+    report = main(args)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
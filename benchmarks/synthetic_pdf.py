@@ -0,0 +1,52 @@
+"""Deterministic synthetic PDFs for benchmarks, built without any PDF-writing dependency."""
+import random
+
+WORDS = (
+    "agreement party clause section payment deadline notice term renewal invoice "
+    "liability warranty delivery schedule amendment appendix obligation service "
+    "customer supplier confidential termination fee penalty audit report"
+).split()
+
+
+def page_text(page_number: int, lines: int = 40, words_per_line: int = 12, seed: int = 0) -> str:
+    rng = random.Random(seed * 1_000_003 + page_number)
+    body = [
+        " ".join(rng.choice(WORDS) for _ in range(words_per_line))
+        for _ in range(lines - 1)
+    ]
+    # A unique, exact-match term per page, like a clause number or SKU
+    return "\n".join([f"Section {page_number}.1 reference SKU-{page_number:05d}"] + body)
+
+
+def build_pdf(pages) -> bytes:
+    """Build a minimal PDF with one Helvetica text page per entry in `pages`."""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>"]
+    kids = " ".join(f"{3 + 2 * i} 0 R" for i in range(len(pages)))
+    objects.append(f"<< /Type /Pages /Kids [{kids}] /Count {len(pages)} >>".encode())
+    font_id = 3 + 2 * len(pages)
+
+    for i, text in enumerate(pages):
+        lines = [line.replace("\\", "").replace("(", "").replace(")", "") for line in text.split("\n")]
+        stream = ("BT /F1 9 Tf 40 760 Td 11 TL " + " ".join(f"({line}) Tj T*" for line in lines) + " ET").encode()
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents {4 + 2 * i} 0 R "
+            f"/Resources << /Font << /F1 {font_id} 0 R >> >> >>".encode()
+        )
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+    objects.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+def synthetic_pdf(page_count: int, seed: int = 0) -> bytes:
+    return build_pdf([page_text(n, seed=seed) for n in range(1, page_count + 1)])
@@ -0,0 +1,30 @@
+"""Production serving: `gunicorn -c gunicorn.conf.py main:app`.
+
+Run `python -m app.migrate` first; workers never create tables. The app and
+its heavy libraries are imported once in the master and workers are forked
+from it, so adding workers costs a fork and the app's startup, not an import.
+Each worker opens at most 2 x (DB_POOL_SIZE + DB_MAX_OVERFLOW) database
+connections, one pool each for the sync and async engines.
+"""
+import os
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = os.getenv("PRELOAD_APP", "true").lower() == "true"
+timeout = int(os.getenv("WORKER_TIMEOUT", "120"))
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+keepalive = int(os.getenv("KEEPALIVE", "5"))
+
+
+def on_starting(server):
+    if server.cfg.preload_app:
+        from app.preload import preload_libraries
+        preload_libraries()
+
+
+def post_fork(server, worker):
+    # Pools created in the master must not hand its connections to a worker
+    from app.db import engine, async_engine
+    engine.dispose(close=False)
+    async_engine.sync_engine.dispose(close=False)
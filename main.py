@@ -1,17 +1,51 @@
+import asyncio
+from contextlib import asynccontextmanager
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
+from sqlalchemy import select
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
 
 from app.config import settings
 from app.routes import pdf_route, chat_route, auth_route
-from app.db import engine, Base
+from app.db import async_engine, AsyncSessionLocal
+from app.services.llm_service import LLMRegistry
+from app.services.metrics_service import MetricsMiddleware, register_cache_metrics
+from app.services.upload_service import UploadLimitMiddleware
+from app.services.kb_cache import kb_cache
+from app.services.answer_cache import answer_cache
+from app.services.principal_cache import principal_cache
+from app.services.upstream_scheduler import upstream_scheduler
+from app.services.ingestion_service import start_job_heartbeat, stop_job_heartbeat
+from app.services.token_service import get_encoding
+from app.services.executor_service import run_blocking
+from app.models.user_model import User
 
-Base.metadata.create_all(bind=engine)
+# The schema is managed by `python -m app.migrate`, run once per deploy rather than by every worker
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Build LLM clients and chains once per process and share them across requests
+    app.state.llm_registry = LLMRegistry()
+    # LLM and embedding calls are admitted on this loop, including ingestion's from worker threads
+    upstream_scheduler.bind(asyncio.get_running_loop())
+    # Token counting runs on the loop, so the tokenizer, which tiktoken may have to
+    # download, is loaded here rather than by the first question
+    await run_blocking(get_encoding)
+    # Keeps this worker's ingestion jobs marked alive and settles those of workers that died
+    start_job_heartbeat()
+    yield
+    stop_job_heartbeat()
+    upstream_scheduler.close()
+    await app.state.llm_registry.aclose()
+    await async_engine.dispose()
 
 app = FastAPI(
     title=settings.PROJECT_NAME,
     description="API for chatting with PDF documents",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 app.add_middleware(
@@ -20,7 +54,11 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "Retry-After"],
 )
+app.add_middleware(UploadLimitMiddleware)
+app.add_middleware(MetricsMiddleware)
+register_cache_metrics({"kb": kb_cache, "answer": answer_cache, "principal": principal_cache})
 
 app.include_router(auth_route.router, prefix=settings.API_V1_STR)
 app.include_router(pdf_route.router, prefix=settings.API_V1_STR)
@@ -30,6 +68,22 @@ app.include_router(chat_route.router, prefix=settings.API_V1_STR)
 def root():
     return {"message": "Welcome to Chat-PDF!"}
 
+@app.get("/ready", include_in_schema=False)
+async def ready():
+    # Readiness, for load balancers and orchestrators: the app has started and the
+    # migrated database answers. GET / stays a liveness check that touches nothing
+    try:
+        async with AsyncSessionLocal() as db:
+            await db.execute(select(User.id).limit(1))
+    except Exception as error:
+        return JSONResponse({"status": "unavailable", "detail": f"Database not ready: {str(error)}"}, status_code=503)
+    return {"status": "ready"}
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    # Prometheus text format; counters are per worker process
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file